@@ -2,11 +2,24 @@
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import io
 import logging
 import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
 
-from google import genai
+if TYPE_CHECKING:
+    from google import genai
+
+from bot.workers import WorkerPool
+
+try:
+    import pypdfium2 as pdfium  # PDFium bindings: much faster text extraction than PyPDF2
+except ImportError:
+    pdfium = None
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +46,32 @@ WORK_TYPE_LABELS = {
 }
 
 
+class _PromptHeads(dict):
+    """Prompt text preceding the source material, pre-rendered per work type."""
+
+    def __missing__(self, work_type: str) -> str:
+        return self["report"]
+
+
+_PROMPT_HEAD, _, _PROMPT_TAIL = REPORT_PROMPT.partition("{text}")
+_PROMPT_HEADS = _PromptHeads(
+    (key, _PROMPT_HEAD.format(work_type_label=label)) for key, label in WORK_TYPE_LABELS.items()
+)
+
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# PDF parsing is CPU-bound (PyPDF2 also holds the GIL), so it runs in worker processes;
+# pages are split into contiguous ranges of at least PDF_MIN_PAGES_PER_TASK
+PDF_POOL_WORKERS = 2
+PDF_MIN_PAGES_PER_TASK = 4
+
+# Partial report text is passed to the progress callback at most this often while streaming
+STREAM_PROGRESS_INTERVAL_S = 1.5
+
+# Generated reports kept in memory, keyed by (source text, work type)
+REPORT_CACHE_SIZE = 128
+
+
 def extract_text_from_docx(data: bytes) -> str:
     """Extract plain text from a DOCX file."""
     from docx import Document
@@ -43,58 +82,179 @@ def extract_text_from_docx(data: bytes) -> str:
 
 def extract_text_from_pdf(data: bytes) -> str:
     """Extract plain text from a PDF file."""
+    return "\n".join(_extract_pdf_pages(data))
+
+
+def _pdf_page_count(data: bytes) -> int:
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(data)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    from PyPDF2 import PdfReader
+
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+
+def _extract_pdf_pages(data: bytes, start: int = 0, stop: int | None = None) -> list[str]:
+    """Extract the non-empty text of pages[start:stop]; the unit of work for pool workers."""
+    if pdfium is not None:
+        return _extract_pdf_pages_pdfium(data, start, stop)
+
     from PyPDF2 import PdfReader
 
     reader = PdfReader(io.BytesIO(data))
     pages = []
-    for page in reader.pages:
+    for page in reader.pages[start:stop]:
         text = page.extract_text()
         if text:
             pages.append(text)
-    return "\n".join(pages)
+    return pages
+
+
+def _extract_pdf_pages_pdfium(data: bytes, start: int, stop: int | None) -> list[str]:
+    pdf = pdfium.PdfDocument(data)
+    try:
+        pages = []
+        for index in range(*slice(start, stop).indices(len(pdf))):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            text = textpage.get_text_range().replace("\r\n", "\n")
+            textpage.close()
+            page.close()
+            if text:
+                pages.append(text)
+        return pages
+    finally:
+        pdf.close()
 
 
 def extract_text(data: bytes, filename: str) -> str:
     """Dispatch text extraction by file extension."""
-    name = filename.lower()
-    if name.endswith(".docx"):
+    suffix = os.path.splitext(filename)[1].lower()
+    if suffix == ".docx":
         return extract_text_from_docx(data)
-    if name.endswith(".pdf"):
+    if suffix == ".pdf":
         return extract_text_from_pdf(data)
-    if name.endswith(".txt"):
+    if suffix == ".txt":
         return data.decode("utf-8", errors="replace")
     raise ValueError(f"Unsupported format: {filename}")
 
 
-async def generate_report(text: str, work_type: str) -> str:
-    """Call Gemini 2.0 Flash to generate a structured Markdown report."""
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY is not set")
+_pdf_pool = WorkerPool(PDF_POOL_WORKERS)
+
+
+async def _extract_pdf_parallel(data: bytes) -> str:
+    """Extract PDF text with page ranges spread across the process pool."""
+    count = await _pdf_pool.run(_pdf_page_count, data)
+    step = max(PDF_MIN_PAGES_PER_TASK, -(-count // PDF_POOL_WORKERS))
+    chunks = await asyncio.gather(*(
+        _pdf_pool.run(_extract_pdf_pages, data, start, start + step)
+        for start in range(0, count, step)
+    ))
+    return "\n".join(text for chunk in chunks for text in chunk)
 
-    # Set proxy for Gemini requests if configured (for geo-restricted regions)
+
+async def extract_text_async(data: bytes, filename: str) -> str:
+    """Like extract_text, but runs the blocking DOCX/PDF parsers off the event loop."""
+    suffix = os.path.splitext(filename)[1].lower()
+    if suffix == ".pdf":
+        return await _extract_pdf_parallel(data)
+    if suffix == ".docx":
+        return await asyncio.to_thread(extract_text_from_docx, data)
+    return extract_text(data, filename)
+
+
+@contextmanager
+def _gemini_proxy():
+    """Route Gemini requests through GEMINI_PROXY_URL (for geo-restricted regions) while active."""
     proxy_url = os.getenv("GEMINI_PROXY_URL")
     if proxy_url:
         os.environ["HTTPS_PROXY"] = proxy_url
         os.environ["HTTP_PROXY"] = proxy_url
-
     try:
-        client = genai.Client(api_key=api_key)
-
-        work_type_label = WORK_TYPE_LABELS.get(work_type, "Отчёт")
-        prompt = REPORT_PROMPT.format(work_type_label=work_type_label, text=text)
-
-        response = await client.aio.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
-        )
+        yield
     finally:
         # Remove proxy env vars so they don't affect Telegram API requests
         if proxy_url:
             os.environ.pop("HTTPS_PROXY", None)
             os.environ.pop("HTTP_PROXY", None)
 
-    if not response.text:
+
+_client: genai.Client | None = None
+
+
+def _get_client() -> genai.Client:
+    """Return the shared Gemini client, building it (and its connection pool) on first use."""
+    global _client
+    if _client is None:
+        # Imported here: google-genai takes over a second to import and only /report needs it
+        from google import genai
+        _client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+    return _client
+
+
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+
+async def _generate_streamed(client: genai.Client, prompt: str,
+                             on_progress: Optional[ProgressCallback]) -> str:
+    """Stream one completion and return its full text, reporting partial text along the way."""
+    loop = asyncio.get_running_loop()
+    parts: list[str] = []
+    next_flush = loop.time() + STREAM_PROGRESS_INTERVAL_S
+    stream = await client.aio.models.generate_content_stream(model=GEMINI_MODEL, contents=prompt)
+    async for chunk in stream:
+        if not chunk.text:
+            continue
+        parts.append(chunk.text)
+        if on_progress is not None and loop.time() >= next_flush:
+            next_flush = loop.time() + STREAM_PROGRESS_INTERVAL_S
+            try:
+                await on_progress("".join(parts))
+            except Exception:
+                logger.debug("Report progress callback failed", exc_info=True)
+    return "".join(parts)
+
+
+_report_cache: OrderedDict[str, str] = OrderedDict()
+
+
+def _report_cache_key(text: str, work_type: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(work_type.encode())
+    h.update(b"\0")
+    h.update(text.encode("utf-8", "surrogatepass"))  # lone surrogates can arrive from Telegram
+    return h.hexdigest()
+
+
+async def generate_report(text: str, work_type: str,
+                          on_progress: Optional[ProgressCallback] = None) -> str:
+    """Call Gemini 2.0 Flash to generate a structured Markdown report.
+
+    The response is streamed; if ``on_progress`` is given it is awaited with the
+    text received so far, throttled to STREAM_PROGRESS_INTERVAL_S.
+    """
+    if not os.getenv("GEMINI_API_KEY"):
+        raise RuntimeError("GEMINI_API_KEY is not set")
+
+    key = _report_cache_key(text, work_type)
+    cached = _report_cache.get(key)
+    if cached is not None:
+        _report_cache.move_to_end(key)
+        return cached
+
+    prompt = f"{_PROMPT_HEADS[work_type]}{text}{_PROMPT_TAIL}"
+
+    with _gemini_proxy():
+        report = await _generate_streamed(_get_client(), prompt, on_progress)
+
+    if not report:
         raise ValueError("AI returned empty result")
 
-    return response.text
+    _report_cache[key] = report
+    if len(_report_cache) > REPORT_CACHE_SIZE:
+        _report_cache.popitem(last=False)
+    return report
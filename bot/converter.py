@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import re
+import sys
 from dataclasses import dataclass, field
 from typing import List, Optional
 
@@ -12,7 +13,7 @@ import mistune
 
 # --- Block dataclasses ---
 
-@dataclass
+@dataclass(slots=True)
 class Run:
     """A piece of text with formatting."""
     text: str
@@ -21,42 +22,44 @@ class Run:
     code: bool = False
 
 
-@dataclass
+@dataclass(slots=True)
 class HeadingBlock:
     level: int
     text: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ParagraphBlock:
     runs: List[Run] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class ListBlock:
     ordered: bool
     items: List[List[Run]] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class CodeBlock:
     language: str
     code: str
 
 
-@dataclass
+@dataclass(slots=True)
 class TableBlock:
     headers: List[str] = field(default_factory=list)
     rows: List[List[str]] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class ImageBlock:
     alt: str
     url: str
+    # Image bytes, set on the copies docx_builder.prefetch_images returns; b"" if the download failed
+    data: Optional[bytes] = field(default=None, repr=False, compare=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class BlockquoteBlock:
     runs: List[Run] = field(default_factory=list)
 
@@ -67,9 +70,14 @@ Block = HeadingBlock | ParagraphBlock | ListBlock | CodeBlock | TableBlock | Ima
 # --- Frontmatter extraction ---
 
 _FRONTMATTER_RE = re.compile(r"\A---\s*\n(.*?)\n---\s*\n", re.DOTALL)
+# The closing --- is only searched for within this many leading characters
+_FRONTMATTER_MAX_LEN = 4096
 
+# libyaml-backed loader when available, pure-Python SafeLoader otherwise
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
-@dataclass
+
+@dataclass(slots=True)
 class Metadata:
     title: str = ""
     author: str = ""
@@ -86,11 +94,16 @@ class Metadata:
 
 def extract_frontmatter(text: str) -> tuple[Metadata, str]:
     """Extract YAML frontmatter from Markdown text. Returns (metadata, remaining_md)."""
-    m = _FRONTMATTER_RE.match(text)
+    if not text.startswith("---"):
+        return Metadata(), text
+    m = _FRONTMATTER_RE.match(text, 0, _FRONTMATTER_MAX_LEN)
     if not m:
         return Metadata(), text
+    header = m.group(1)
+    if not header.strip():
+        return Metadata(), text[m.end():]
     try:
-        raw = yaml.safe_load(m.group(1)) or {}
+        raw = yaml.load(header, Loader=_YAML_LOADER) or {}
     except yaml.YAMLError as e:
         raise ValueError(
             f"Ошибка в YAML-заголовке документа: {e}\n"
@@ -115,62 +128,123 @@ def extract_frontmatter(text: str) -> tuple[Metadata, str]:
 
 # --- AST walking ---
 
-def _inline_to_runs(children: list) -> List[Run]:
-    """Convert mistune inline AST nodes to a list of Runs."""
-    runs: List[Run] = []
-    if children is None:
+# Shared newline text for line-break and paragraph-separator runs
+_NL = sys.intern("\n")
+
+
+def _emit(runs: List[Run], text: str, bold: bool = False, italic: bool = False, code: bool = False) -> None:
+    """Append text to runs, extending the last Run instead when its formatting matches."""
+    if runs:
+        last = runs[-1]
+        if last.bold == bold and last.italic == italic and last.code == code:
+            last.text += text
+            return
+    runs.append(Run(text=text, bold=bold, italic=italic, code=code))
+
+
+def _inline_text(child: dict, bold: bool, italic: bool, runs: List[Run]):
+    _emit(runs, child.get("raw", child.get("text", "")), bold, italic)
+
+
+def _inline_codespan(child: dict, bold: bool, italic: bool, runs: List[Run]):
+    _emit(runs, child.get("raw", child.get("text", "")), bold, italic, code=True)
+
+
+def _inline_strong(child: dict, bold: bool, italic: bool, runs: List[Run]):
+    return iter(child.get("children") or ()), True, italic, None
+
+
+def _inline_emphasis(child: dict, bold: bool, italic: bool, runs: List[Run]):
+    return iter(child.get("children") or ()), bold, True, None
+
+
+def _inline_link(child: dict, bold: bool, italic: bool, runs: List[Run]):
+    url = child.get("attrs", {}).get("url", "")
+    return iter(child.get("children") or ()), bold, italic, f" ({url})" if url else None
+
+
+def _inline_image(child: dict, bold: bool, italic: bool, runs: List[Run]):
+    alt = _extract_plain_text(child.get("children", []))
+    if alt:
+        _emit(runs, f"[{alt}]", bold, italic)
+
+
+def _inline_break(child: dict, bold: bool, italic: bool, runs: List[Run]):
+    _emit(runs, _NL, bold, italic)
+
+
+def _inline_fallback(child: dict, bold: bool, italic: bool, runs: List[Run]):
+    # Unknown node: try to extract text, else descend into its children
+    raw = child.get("raw", child.get("text", ""))
+    if raw:
+        _emit(runs, raw, bold, italic)
+    elif "children" in child:
+        return iter(child["children"] or ()), bold, italic, None
+
+
+# Inline node type → handler(child, bold, italic, runs). A handler either appends
+# runs directly or returns a new (iterator, bold, italic, tail) frame to descend into.
+_INLINE_HANDLERS = {
+    "text": _inline_text,
+    "codespan": _inline_codespan,
+    "strong": _inline_strong,
+    "emphasis": _inline_emphasis,
+    "link": _inline_link,
+    "image": _inline_image,
+    "softbreak": _inline_break,
+    "linebreak": _inline_break,
+}
+
+
+def _inline_to_runs(children: list, runs: Optional[List[Run]] = None) -> List[Run]:
+    """Convert mistune inline AST nodes to a list of Runs.
+
+    Walks the tree with an explicit stack of (iterator, bold, italic, tail) frames;
+    formatting is inherited from enclosing strong/emphasis nodes, and ``tail`` is
+    text emitted once a frame is exhausted (the URL after a link's label).
+    Runs are appended to ``runs`` when given, so callers can accumulate in place;
+    adjacent text with identical formatting is merged into a single Run.
+    """
+    if runs is None:
+        runs = []
+    if not children:
         return runs
-    for child in children:
-        tp = child.get("type", "")
-        if tp == "text":
-            runs.append(Run(text=child.get("raw", child.get("text", ""))))
-        elif tp == "codespan":
-            runs.append(Run(text=child.get("raw", child.get("text", "")), code=True))
-        elif tp == "strong":
-            for r in _inline_to_runs(child.get("children", [])):
-                r.bold = True
-                runs.append(r)
-        elif tp == "emphasis":
-            for r in _inline_to_runs(child.get("children", [])):
-                r.italic = True
-                runs.append(r)
-        elif tp == "link":
-            url = child.get("attrs", {}).get("url", "")
-            for r in _inline_to_runs(child.get("children", [])):
-                runs.append(r)
-            if url:
-                runs.append(Run(text=f" ({url})"))
-        elif tp == "image":
-            alt = _extract_plain_text(child.get("children", []))
-            if alt:
-                runs.append(Run(text=f"[{alt}]"))
-        elif tp == "softbreak" or tp == "linebreak":
-            runs.append(Run(text="\n"))
+    stack = [(iter(children), False, False, None)]
+    while stack:
+        it, bold, italic, tail = stack[-1]
+        for child in it:
+            handler = _INLINE_HANDLERS.get(child.get("type", ""), _inline_fallback)
+            frame = handler(child, bold, italic, runs)
+            if frame is not None:
+                stack.append(frame)
+                break
         else:
-            # Fallback: try to extract text
-            raw = child.get("raw", child.get("text", ""))
-            if raw:
-                runs.append(Run(text=raw))
-            elif "children" in child:
-                runs.extend(_inline_to_runs(child["children"]))
+            stack.pop()
+            if tail:
+                _emit(runs, tail, bold, italic)
     return runs
 
 
 def _extract_plain_text(children: list) -> str:
-    """Recursively extract plain text from inline AST nodes."""
-    parts = []
-    if children is None:
+    """Extract plain text from inline AST nodes (iteratively, depth-first)."""
+    if not children:
         return ""
-    for child in children:
-        tp = child.get("type", "")
-        if tp == "text":
-            parts.append(child.get("raw", child.get("text", "")))
-        elif tp == "codespan":
-            parts.append(child.get("raw", child.get("text", "")))
-        elif "children" in child:
-            parts.append(_extract_plain_text(child["children"]))
-        elif "raw" in child:
-            parts.append(child["raw"])
+    parts = []
+    stack = [iter(children)]
+    while stack:
+        for child in stack[-1]:
+            tp = child.get("type", "")
+            if tp == "text" or tp == "codespan":
+                v = child.get("raw") or child.get("text")
+                if v:
+                    parts.append(v)
+            elif "children" in child:
+                stack.append(iter(child["children"] or ()))
+                break
+            elif child.get("raw"):
+                parts.append(child["raw"])
+        else:
+            stack.pop()
     return "".join(parts)
 
 
@@ -183,78 +257,107 @@ def _list_items_to_runs(items: list) -> List[List[Run]]:
         for child in children:
             tp = child.get("type", "")
             if tp == "paragraph":
-                item_runs.extend(_inline_to_runs(child.get("children", [])))
+                _inline_to_runs(child.get("children", []), item_runs)
             elif tp == "text":
-                item_runs.append(Run(text=child.get("raw", child.get("text", ""))))
+                _emit(item_runs, child.get("raw", child.get("text", "")))
             elif "children" in child:
-                item_runs.extend(_inline_to_runs(child["children"]))
+                _inline_to_runs(child["children"], item_runs)
         result.append(item_runs)
     return result
 
 
-def _walk_ast(tokens: list) -> List[Block]:
-    """Walk mistune AST tokens and produce typed blocks."""
-    blocks: List[Block] = []
-    for token in tokens:
-        tp = token.get("type", "")
-
-        if tp == "heading":
-            text = _extract_plain_text(token.get("children", []))
-            level = token.get("attrs", {}).get("level", 1)
-            blocks.append(HeadingBlock(level=level, text=text))
-
-        elif tp == "paragraph":
-            children = token.get("children", [])
-            # Standalone image → ImageBlock
-            if len(children) == 1 and children[0].get("type") == "image":
-                img = children[0]
-                alt = _extract_plain_text(img.get("children", []))
-                url = img.get("attrs", {}).get("url", "")
-                blocks.append(ImageBlock(alt=alt, url=url))
-            else:
-                runs = _inline_to_runs(children)
-                if runs:
-                    blocks.append(ParagraphBlock(runs=runs))
-
-        elif tp in ("code_block", "block_code"):
-            info = token.get("attrs", {}).get("info", "") or ""
-            raw = token.get("raw", token.get("text", ""))
-            blocks.append(CodeBlock(language=info, code=raw.rstrip("\n")))
-
-        elif tp == "list":
-            ordered = token.get("attrs", {}).get("ordered", False)
-            items = _list_items_to_runs(token.get("children", []))
-            blocks.append(ListBlock(ordered=ordered, items=items))
-
-        elif tp == "table":
-            tbl = _parse_table(token)
-            if tbl:
-                blocks.append(tbl)
-
-        elif tp == "block_quote":
-            quote_children = token.get("children", [])
-            runs: List[Run] = []
-            for child in quote_children:
-                child_tp = child.get("type", "")
-                if child_tp == "paragraph":
-                    if runs:
-                        runs.append(Run(text="\n"))
-                    runs.extend(_inline_to_runs(child.get("children", [])))
-                elif "children" in child:
-                    if runs:
-                        runs.append(Run(text="\n"))
-                    runs.extend(_inline_to_runs(child["children"]))
+def _block_heading(token: dict, blocks: List[Block]):
+    text = _extract_plain_text(token.get("children", []))
+    level = token.get("attrs", {}).get("level", 1)
+    blocks.append(HeadingBlock(level=level, text=text))
+
+
+def _block_paragraph(token: dict, blocks: List[Block]):
+    children = token.get("children", [])
+    # Standalone image → ImageBlock
+    if len(children) == 1 and children[0].get("type") == "image":
+        img = children[0]
+        alt = _extract_plain_text(img.get("children", []))
+        url = img.get("attrs", {}).get("url", "")
+        blocks.append(ImageBlock(alt=alt, url=url))
+    else:
+        runs = _inline_to_runs(children)
+        if runs:
+            blocks.append(ParagraphBlock(runs=runs))
+
+
+def _block_code(token: dict, blocks: List[Block]):
+    info = token.get("attrs", {}).get("info", "") or ""
+    raw = token.get("raw", token.get("text", ""))
+    blocks.append(CodeBlock(language=info, code=raw.rstrip("\n")))
+
+
+def _block_list(token: dict, blocks: List[Block]):
+    ordered = token.get("attrs", {}).get("ordered", False)
+    items = _list_items_to_runs(token.get("children", []))
+    blocks.append(ListBlock(ordered=ordered, items=items))
+
+
+def _block_table(token: dict, blocks: List[Block]):
+    tbl = _parse_table(token)
+    if tbl:
+        blocks.append(tbl)
+
+
+def _block_quote(token: dict, blocks: List[Block]):
+    runs: List[Run] = []
+    for child in token.get("children", []):
+        child_tp = child.get("type", "")
+        if child_tp == "paragraph":
+            if runs:
+                _emit(runs, _NL)
+            _inline_to_runs(child.get("children", []), runs)
+        elif "children" in child:
             if runs:
-                blocks.append(BlockquoteBlock(runs=runs))
+                _emit(runs, _NL)
+            _inline_to_runs(child["children"], runs)
+    if runs:
+        blocks.append(BlockquoteBlock(runs=runs))
+
+
+def _block_skip(token: dict, blocks: List[Block]):
+    pass  # horizontal rules, blank lines
+
 
-        elif tp == "thematic_break":
-            pass  # skip horizontal rules
+def _block_fallback(token: dict, blocks: List[Block]):
+    # Unknown container: descend into its children
+    return token.get("children")
 
-        elif tp == "blank_line":
-            pass
 
-        elif "children" in token:
-            blocks.extend(_walk_ast(token["children"]))
+# Block token type → handler(token, blocks). A handler appends blocks directly or
+# returns a list of child tokens to walk next.
+_BLOCK_HANDLERS = {
+    "heading": _block_heading,
+    "paragraph": _block_paragraph,
+    "code_block": _block_code,
+    "block_code": _block_code,
+    "list": _block_list,
+    "table": _block_table,
+    "block_quote": _block_quote,
+    "thematic_break": _block_skip,
+    "blank_line": _block_skip,
+}
+
+
+def _walk_ast(tokens: list) -> List[Block]:
+    """Walk mistune AST tokens and produce typed blocks."""
+    blocks: List[Block] = []
+    # Stack of token iterators: nested containers are descended into without recursion
+    stack = [iter(tokens)]
+    while stack:
+        for token in stack[-1]:
+            handler = _BLOCK_HANDLERS.get(token.get("type", ""), _block_fallback)
+            children = handler(token, blocks)
+            if children is not None:
+                stack.append(iter(children))
+                break
+        else:
+            stack.pop()
 
     return blocks
 
@@ -286,10 +389,13 @@ def _parse_table(token: dict) -> Optional[TableBlock]:
 
 # --- Public API ---
 
+# Built once: mistune keeps per-call state in a fresh BlockState, so one instance serves all documents
+_MD_AST = mistune.create_markdown(renderer="ast", plugins=["table", "strikethrough"])
+
+
 def parse_markdown(text: str) -> tuple[Metadata, List[Block]]:
     """Parse Markdown text into metadata and a list of typed blocks."""
     meta, body = extract_frontmatter(text)
-    md = mistune.create_markdown(renderer="ast", plugins=["table", "strikethrough"])
-    ast = md(body)
+    ast = _MD_AST(body)
     blocks = _walk_ast(ast)
     return meta, blocks
@@ -2,15 +2,27 @@
 
 from __future__ import annotations
 
+import asyncio
 import io
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from copy import deepcopy
+from dataclasses import replace
 from datetime import datetime
+from functools import lru_cache, wraps
+from xml.sax.saxutils import escape
 
 from docx import Document
 from docx.shared import Pt, Cm, Mm, RGBColor, Emu
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_BREAK
 from docx.enum.table import WD_TABLE_ALIGNMENT
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
+from docx.oxml.ns import qn, nsdecls
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.table import CT_Tbl
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 
 from bot.converter import (
     Block, HeadingBlock, ParagraphBlock, ListBlock, CodeBlock, TableBlock,
@@ -20,24 +32,194 @@ from bot.converter import (
 from bot.styles import (
     FONT_NAME, FONT_SIZE, CODE_FONT_NAME, CODE_FONT_SIZE, TABLE_FONT_SIZE,
     LINE_SPACING, PARAGRAPH_INDENT, WORK_TYPES,
-    setup_page, setup_default_style, set_run_font, set_paragraph_format,
+    PAGE_WIDTH, MARGIN_LEFT, MARGIN_RIGHT,
+    setup_page, setup_default_style,
     DEFAULT_UNIVERSITY, DEFAULT_INSTITUTE, DEFAULT_DEPARTMENT,
     DEFAULT_CITY, DEFAULT_GROUP,
 )
+from bot.workers import WorkerPool
+
+# Text area width; tables span it, as with Document.add_table
+CONTENT_WIDTH = Emu(PAGE_WIDTH - MARGIN_LEFT - MARGIN_RIGHT)
+
+# Worker processes for build_docx_async: builds are CPU-bound and hold the GIL
+DOCX_POOL_WORKERS = 2
+
+# DEFLATE level for saved documents: they are sent once, so trade size for speed
+DOCX_COMPRESS_LEVEL = 1
+
+
+
+def _use_fast_compression() -> None:
+    """Make python-docx's zip writer use DOCX_COMPRESS_LEVEL.
+
+    python-docx has no option for this, so its private writer is wrapped: after its own
+    __init__, the ZipFile's default compresslevel (used by writestr) is lowered. If the
+    private API is missing or changed, documents are simply saved at the default level.
+    """
+    try:
+        from docx.opc.phys_pkg import _ZipPkgWriter
+    except ImportError:
+        return
+    init = _ZipPkgWriter.__init__
+    if getattr(init, "_fast_compression", False):
+        return
+
+    @wraps(init)
+    def __init__(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        zipf = getattr(self, "_zipf", None)
+        if isinstance(zipf, zipfile.ZipFile) and zipf.compression == zipfile.ZIP_DEFLATED:
+            zipf.compresslevel = DOCX_COMPRESS_LEVEL
+
+    __init__._fast_compression = True
+    _ZipPkgWriter.__init__ = __init__
+
+
+_use_fast_compression()
+
+# --- Cached XML fragments (parsed once, deep-copied per use) ---
+
+_TABLE_BORDERS = parse_xml(
+    f"<w:tblBorders {nsdecls('w')}>"
+    + "".join(
+        f'<w:{side} w:val="single" w:sz="4" w:space="0" w:color="000000"/>'
+        for side in ("top", "left", "bottom", "right", "insideH", "insideV")
+    )
+    + "</w:tblBorders>"
+)
+
+# Right-aligned dot-leader tab at the right margin
+# (~16.5cm from left margin for A4 with 30mm+15mm margins, in twips)
+_TOC_TAB_STOP_XML = '<w:tabs><w:tab w:val="right" w:leader="dot" w:pos="9356"/></w:tabs>'
+
+# (font_name, font_size, bold, italic) → <w:rPr>: font (with the Cyrillic fallback), explicit
+# bold/italic, black text and size
+_RUN_FORMAT_XML: dict[tuple, str] = {}
+_RUN_FORMATS: dict[tuple, object] = {}
+
+
+def _run_format_xml(font_name=FONT_NAME, font_size=FONT_SIZE, bold=False, italic=False) -> str:
+    key = (font_name, font_size, bold, italic)
+    xml = _RUN_FORMAT_XML.get(key)
+    if xml is None:
+        xml = _RUN_FORMAT_XML[key] = (
+            "<w:rPr>"
+            f'<w:rFonts w:ascii="{font_name}" w:hAnsi="{font_name}" '
+            f'w:eastAsia="{font_name}" w:cs="{font_name}"/>'
+            + ("<w:b/>" if bold else '<w:b w:val="0"/>')
+            + ("<w:i/>" if italic else '<w:i w:val="0"/>')
+            + '<w:color w:val="000000"/>'
+            f'<w:sz w:val="{round(font_size.pt * 2)}"/>'
+            "</w:rPr>"
+        )
+    return xml
+
+
+def _set_run_format(run, font_name=FONT_NAME, font_size=FONT_SIZE, bold=False, italic=False):
+    """Format a fresh run by cloning a cached rPr."""
+    key = (font_name, font_size, bold, italic)
+    rPr = _RUN_FORMATS.get(key)
+    if rPr is None:
+        xml = _run_format_xml(font_name, font_size, bold, italic)
+        rPr = _RUN_FORMATS[key] = parse_xml(xml.replace("<w:rPr>", f"<w:rPr {_W}>", 1))
+    run._r.insert(0, deepcopy(rPr))
+
+
+# --- Paragraph XML ---
+# Body blocks are emitted as one XML string per paragraph and parsed once, instead of
+# going through python-docx's per-property and per-character run APIs.
+
+_W = nsdecls("w")
+
+_JC = {
+    WD_ALIGN_PARAGRAPH.LEFT: "left",
+    WD_ALIGN_PARAGRAPH.CENTER: "center",
+    WD_ALIGN_PARAGRAPH.RIGHT: "right",
+    WD_ALIGN_PARAGRAPH.JUSTIFY: "both",
+}
+
+# Tabs and line breaks become their own elements, as in Run.text
+_RUN_TEXT_RE = re.compile(r"\t|[\r\n]|[^\t\r\n]+")
+
+
+@lru_cache(maxsize=None)
+def _ppr_xml(alignment=WD_ALIGN_PARAGRAPH.JUSTIFY, first_line_indent=PARAGRAPH_INDENT,
+             space_before=Pt(0), space_after=Pt(0), line_spacing=LINE_SPACING,
+             left_indent=None, extra="") -> str:
+    """GOST <w:pPr> for body paragraphs (plus an optional left indent and trailing children)."""
+    left = f' w:left="{left_indent.twips}"' if left_indent is not None else ""
+    return (
+        "<w:pPr>"
+        f'<w:spacing w:before="{space_before.twips}" w:after="{space_after.twips}" '
+        f'w:line="{round(line_spacing * 240)}" w:lineRule="auto"/>'
+        f'<w:ind w:firstLine="{first_line_indent.twips}"{left}/>'
+        f'<w:jc w:val="{_JC[alignment]}"/>'
+        f"{extra}"
+        "</w:pPr>"
+    )
+
+
+def _run_xml(text: str, rpr_xml: str, trailing: str = "") -> str:
+    """<w:r> holding text the way Paragraph.add_run(text) would lay it out."""
+    parts = ["<w:r>", rpr_xml]
+    for piece in _RUN_TEXT_RE.findall(text):
+        if piece == "\t":
+            parts.append("<w:tab/>")
+        elif piece == "\n" or piece == "\r":
+            parts.append("<w:br/>")
+        elif len(piece.strip()) < len(piece):
+            parts.append(f'<w:t xml:space="preserve">{escape(piece)}</w:t>')
+        else:
+            parts.append(f"<w:t>{escape(piece)}</w:t>")
+    parts.append(trailing)
+    parts.append("</w:r>")
+    return "".join(parts)
+
+
+def _body_runs_xml(runs: list[Run]) -> str:
+    return "".join(
+        _run_xml(r.text, _run_format_xml(CODE_FONT_NAME, CODE_FONT_SIZE) if r.code
+                 else _run_format_xml(bold=r.bold, italic=r.italic))
+        for r in runs
+    )
+
+
+def _insert_paragraph_xml(tail: Paragraph, ppr_xml: str, runs_xml: str) -> None:
+    tail._p.addprevious(parse_xml(f"<w:p {_W}>{ppr_xml}{runs_xml}</w:p>"))
+
+
+# pPr XML → parsed element, deep-copied onto paragraphs built through the python-docx API
+_PPRS: dict[str, object] = {}
+
+
+def _set_ppr(p: Paragraph, ppr_xml: str) -> None:
+    """Format a fresh paragraph by cloning a cached pPr."""
+    pPr = _PPRS.get(ppr_xml)
+    if pPr is None:
+        pPr = _PPRS[ppr_xml] = parse_xml(ppr_xml.replace("<w:pPr>", f"<w:pPr {_W}>", 1))
+    p._p.insert(0, deepcopy(pPr))
 
 
 def build_docx(blocks: list[Block], metadata: Metadata, work_type: str = "lab") -> io.BytesIO:
-    """Build a GOST-formatted DOCX from parsed blocks and metadata. Returns a BytesIO."""
-    doc = Document()
-    setup_page(doc)
-    setup_default_style(doc)
+    """Build a GOST-formatted DOCX from parsed blocks and metadata. Returns a BytesIO.
 
-    _add_title_page(doc, metadata, work_type)
-    _add_page_break(doc)
-    _add_toc(doc, blocks)
-    _add_page_break(doc)
-    _render_blocks(doc, blocks)
-    _add_page_numbers(doc)
+    Content is inserted before a sentinel ``tail`` paragraph: Document.add_paragraph
+    scans the whole body for sectPr on every call, which makes appending O(N²).
+    """
+    doc = Document(io.BytesIO(_base_document()))
+
+    # Headings and their section numbers are collected once for both the TOC and the body
+    headings = [b for b in blocks if isinstance(b, HeadingBlock)]
+    numbers = _section_numbers([h.level for h in headings])
+
+    tail = doc.add_paragraph()
+    _add_title_page(tail, metadata, work_type)
+    _add_page_break(tail)
+    _add_toc(tail, headings, numbers)
+    _add_page_break(tail)
+    _render_blocks(tail, blocks, numbers)
+    tail._p.getparent().remove(tail._p)
 
     buf = io.BytesIO()
     doc.save(buf)
@@ -45,36 +227,76 @@ def build_docx(blocks: list[Block], metadata: Metadata, work_type: str = "lab")
     return buf
 
 
+_docx_pool = WorkerPool(DOCX_POOL_WORKERS)
+
+
+def _build_docx_bytes(blocks: list[Block], metadata: Metadata, work_type: str) -> bytes:
+    return build_docx(blocks, metadata, work_type).getvalue()
+
+
+async def build_docx_async(blocks: list[Block], metadata: Metadata, work_type: str = "lab") -> io.BytesIO:
+    """Like build_docx, but runs in the process pool so concurrent builds use separate cores."""
+    data = await _docx_pool.run(_build_docx_bytes, blocks, metadata, work_type)
+    return io.BytesIO(data)
+
+
+@lru_cache(maxsize=1)
+def _base_document() -> bytes:
+    """Empty document with page setup, default style and page-number footer, saved once.
+
+    None of it depends on the content, so each build reopens these bytes instead of
+    loading python-docx's template and applying the same settings again.
+    """
+    doc = Document()
+    setup_page(doc)
+    setup_default_style(doc)
+    _add_page_numbers(doc)
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
 # --- Helpers ---
 
-def _centered_line(doc, text, bold=True, font_size=Pt(12), space_before=Pt(0), space_after=Pt(0)):
+def _centered_line(tail: Paragraph, text, bold=True, font_size=Pt(12), space_before=Pt(0), space_after=Pt(0)):
     """Add a centered paragraph with given formatting."""
-    p = doc.add_paragraph()
-    set_paragraph_format(p, alignment=WD_ALIGN_PARAGRAPH.CENTER,
-                         first_line_indent=Cm(0), line_spacing=1.0,
-                         space_before=space_before, space_after=space_after)
+    p = tail.insert_paragraph_before()
+    _set_ppr(p, _ppr_xml(WD_ALIGN_PARAGRAPH.CENTER, Cm(0), space_before, space_after, 1.0))
     if text:
         run = p.add_run(text)
-        set_run_font(run, font_size=font_size, bold=bold)
+        _set_run_format(run, font_size=font_size, bold=bold)
     return p
 
 
-def _right_block_line(doc, text, bold=False, font_size=Pt(12), left_indent=Cm(10)):
+def _right_block_line(tail: Paragraph, text, bold=False, font_size=Pt(12), left_indent=Cm(10)):
     """Add a left-aligned paragraph with a big left indent (appears on the right half)."""
-    p = doc.add_paragraph()
-    set_paragraph_format(p, alignment=WD_ALIGN_PARAGRAPH.LEFT,
-                         first_line_indent=Cm(0), line_spacing=1.0,
-                         space_before=Pt(0), space_after=Pt(0))
-    p.paragraph_format.left_indent = left_indent
+    p = tail.insert_paragraph_before()
+    _set_ppr(p, _ppr_xml(WD_ALIGN_PARAGRAPH.LEFT, Cm(0), line_spacing=1.0, left_indent=left_indent))
     if text:
         run = p.add_run(text)
-        set_run_font(run, font_size=font_size, bold=bold)
+        _set_run_format(run, font_size=font_size, bold=bold)
     return p
 
 
 # --- Title page (matching sample format) ---
 
-def _add_title_page(doc: Document, meta: Metadata, work_type: str) -> None:
+_TITLE_SPACER_PPR = _ppr_xml(WD_ALIGN_PARAGRAPH.CENTER, Cm(0), line_spacing=1.0)
+_RIGHT_SPACER_PPR = _ppr_xml(WD_ALIGN_PARAGRAPH.LEFT, Cm(0), line_spacing=1.0, left_indent=Cm(10))
+
+# pPr XML → parsed empty paragraph, deep-copied for each blank line
+_SPACERS: dict[str, object] = {}
+
+
+def _add_spacer(tail: Paragraph, ppr_xml: str = _TITLE_SPACER_PPR, count: int = 1) -> None:
+    """Insert ``count`` empty paragraphs (blank lines) before tail."""
+    p = _SPACERS.get(ppr_xml)
+    if p is None:
+        p = _SPACERS[ppr_xml] = parse_xml(f"<w:p {_W}>{ppr_xml}</w:p>")
+    for _ in range(count):
+        tail._p.addprevious(deepcopy(p))
+
+
+def _add_title_page(tail: Paragraph, meta: Metadata, work_type: str) -> None:
     """Generate a university-style cover page matching the GUMRF sample."""
     university = meta.university or DEFAULT_UNIVERSITY
     institute = meta.institute or DEFAULT_INSTITUTE
@@ -92,431 +314,412 @@ def _add_title_page(doc: Document, meta: Metadata, work_type: str) -> None:
     sz = Pt(12)
 
     # University name block — centered, bold
-    _centered_line(doc, university, bold=True, font_size=sz)
+    _centered_line(tail, university, bold=True, font_size=sz)
 
     # Separator line
-    _centered_line(doc, "–" * 56, bold=True, font_size=sz)
+    _centered_line(tail, "–" * 56, bold=True, font_size=sz)
 
     # Institute
-    _centered_line(doc, institute, bold=True, font_size=sz)
+    _centered_line(tail, institute, bold=True, font_size=sz)
 
     # Empty line
-    _centered_line(doc, "", font_size=sz)
+    _add_spacer(tail)
 
     # Department
-    _centered_line(doc, department, bold=True, font_size=sz)
+    _centered_line(tail, department, bold=True, font_size=sz)
 
     # Spacing
-    for _ in range(2):
-        _centered_line(doc, "", font_size=sz)
+    _add_spacer(tail, count=2)
 
     # "ОТЧЕТ"
-    _centered_line(doc, "ОТЧЕТ", bold=True, font_size=Pt(16))
+    _centered_line(tail, "ОТЧЕТ", bold=True, font_size=Pt(16))
 
     # "по лабораторной работе №X"
     work_line = f"по {work_label}"
     if work_number:
         work_line += f" №{work_number}"
-    _centered_line(doc, work_line, bold=True, font_size=Pt(14))
+    _centered_line(tail, work_line, bold=True, font_size=Pt(14))
 
     # Subject line
     if subject:
-        _centered_line(doc, f"по дисциплине «{subject}»", bold=True, font_size=sz)
+        _centered_line(tail, f"по дисциплине «{subject}»", bold=True, font_size=sz)
 
     # Title
     if title:
-        _centered_line(doc, f"«{title}»", bold=True, font_size=sz,
+        _centered_line(tail, f"«{title}»", bold=True, font_size=sz,
                         space_before=Pt(6))
 
     # Spacing before author block
-    for _ in range(3):
-        _centered_line(doc, "", font_size=sz)
+    _add_spacer(tail, count=3)
 
     left = Cm(10)
 
     # "Выполнил: студент группы XX"
-    _right_block_line(doc, f"Выполнил: студент группы {group}", bold=True, font_size=sz, left_indent=left)
+    _right_block_line(tail, f"Выполнил: студент группы {group}", bold=True, font_size=sz, left_indent=left)
 
     # Empty line
-    _right_block_line(doc, "", font_size=sz, left_indent=left)
+    _add_spacer(tail, _RIGHT_SPACER_PPR)
 
     # Author name + signature line
     if author:
-        _right_block_line(doc, f"{author}   ______________", font_size=sz, left_indent=left)
+        _right_block_line(tail, f"{author}   ______________", font_size=sz, left_indent=left)
     else:
-        _right_block_line(doc, "________________________________________   ______________", font_size=sz, left_indent=left)
+        _right_block_line(tail, "________________________________________   ______________", font_size=sz, left_indent=left)
 
     # Labels
-    p = _right_block_line(doc, "", font_size=Pt(10), left_indent=left)
+    p = _right_block_line(tail, "", font_size=Pt(10), left_indent=left)
     run = p.add_run("          (фамилия, имя, отчество)                    (подпись)")
-    set_run_font(run, font_size=Pt(10))
+    _set_run_format(run, font_size=Pt(10))
 
     # Spacing
-    _right_block_line(doc, "", font_size=sz, left_indent=left)
+    _add_spacer(tail, _RIGHT_SPACER_PPR)
 
     # "Руководитель:"
-    _right_block_line(doc, "Руководитель:", bold=True, font_size=sz, left_indent=left)
+    _right_block_line(tail, "Руководитель:", bold=True, font_size=sz, left_indent=left)
 
     # Empty line
-    _right_block_line(doc, "", font_size=sz, left_indent=left)
+    _add_spacer(tail, _RIGHT_SPACER_PPR)
 
     # Teacher name + signature line
     if teacher:
-        _right_block_line(doc, f"{teacher}   ______________", font_size=sz, left_indent=left)
+        _right_block_line(tail, f"{teacher}   ______________", font_size=sz, left_indent=left)
     else:
-        _right_block_line(doc, "________________________________________   ______________", font_size=sz, left_indent=left)
+        _right_block_line(tail, "________________________________________   ______________", font_size=sz, left_indent=left)
 
     # Labels
-    p = _right_block_line(doc, "", font_size=Pt(10), left_indent=left)
+    p = _right_block_line(tail, "", font_size=Pt(10), left_indent=left)
     run = p.add_run("          (фамилия, имя, отчество)                    (подпись)")
-    set_run_font(run, font_size=Pt(10))
+    _set_run_format(run, font_size=Pt(10))
 
     # Spacing
-    _right_block_line(doc, "", font_size=sz, left_indent=left)
+    _add_spacer(tail, _RIGHT_SPACER_PPR)
 
     # "Представлена на кафедру:" line
-    _right_block_line(doc, f"Представлена на кафедру:   «___» _____________ {year} г.",
+    _right_block_line(tail, f"Представлена на кафедру:   «___» _____________ {year} г.",
                       bold=True, font_size=sz, left_indent=left)
 
     # Spacing before city/year
-    _centered_line(doc, "", font_size=sz)
+    _add_spacer(tail)
 
     # City
-    _centered_line(doc, city, bold=True, font_size=sz)
+    _centered_line(tail, city, bold=True, font_size=sz)
 
     # Year
-    _centered_line(doc, year, bold=True, font_size=sz)
+    _centered_line(tail, year, bold=True, font_size=sz)
 
 
 # --- TOC (generated from actual headings) ---
 
-def _add_toc(doc: Document, blocks: list[Block]) -> None:
-    """Generate a real table of contents from heading blocks."""
-    # Title
-    _centered_line(doc, "СОДЕРЖАНИЕ", bold=True, font_size=Pt(14),
-                   space_after=Pt(12))
-
-    # Collect headings
-    headings = [(b.level, b.text) for b in blocks if isinstance(b, HeadingBlock)]
-    if not headings:
-        p = doc.add_paragraph()
-        set_paragraph_format(p, first_line_indent=Cm(0))
-        run = p.add_run("(Содержание пусто — нет заголовков)")
-        set_run_font(run, font_size=Pt(12), italic=True)
-        return
-
-    # Section numbering counters
-    counters = [0, 0, 0]  # H1, H2, H3
-
-    for level, text in headings:
+def _section_numbers(levels: list[int]) -> list[str]:
+    """Section numbers ("1", "1.2", "1.2.3") for headings of the given levels; H4+ count as H3."""
+    h1 = h2 = h3 = 0
+    numbers = []
+    append = numbers.append
+    for level in levels:
         if level == 1:
-            counters[0] += 1
-            counters[1] = 0
-            counters[2] = 0
-            num = str(counters[0])
+            h1 += 1
+            h2 = h3 = 0
+            append(str(h1))
         elif level == 2:
-            counters[1] += 1
-            counters[2] = 0
-            num = f"{counters[0]}.{counters[1]}"
+            h2 += 1
+            h3 = 0
+            append(f"{h1}.{h2}")
         else:
-            counters[2] += 1
-            num = f"{counters[0]}.{counters[1]}.{counters[2]}"
+            h3 += 1
+            append(f"{h1}.{h2}.{h3}")
+    return numbers
+
 
-        indent = Cm((level - 1) * 1.0)
+def _add_toc(tail: Paragraph, headings: list[HeadingBlock], numbers: list[str]) -> None:
+    """Generate a real table of contents from heading blocks and their section numbers."""
+    # Title
+    _centered_line(tail, "СОДЕРЖАНИЕ", bold=True, font_size=Pt(14),
+                   space_after=Pt(12))
 
-        p = doc.add_paragraph()
-        set_paragraph_format(p, alignment=WD_ALIGN_PARAGRAPH.LEFT,
-                             first_line_indent=Cm(0),
-                             space_before=Pt(2), space_after=Pt(2),
-                             line_spacing=1.5)
-        p.paragraph_format.left_indent = indent
+    if not headings:
+        _insert_paragraph_xml(tail, _ppr_xml(first_line_indent=Cm(0)), _run_xml(
+            "(Содержание пусто — нет заголовков)", _run_format_xml(font_size=Pt(12), italic=True)))
+        return
 
-        # Use tab leader dots
+    for heading, num in zip(headings, numbers):
+        level, text = heading.level, heading.text
         display_text = text.upper() if level == 1 else text
         entry = f"{num} {display_text}"
-        run = p.add_run(entry)
-        font_sz = Pt(14)
-        set_run_font(run, font_size=font_sz, bold=(level == 1))
+        _insert_paragraph_xml(tail, _toc_ppr(level),
+                              _run_xml(entry, _TOC_ENTRY_RPR[level == 1]) + _TOC_TAB_RUN)
+
 
-        # Add dotted tab stop + page placeholder
-        _add_toc_tab_stop(p)
-        tab_run = p.add_run("\t")
-        set_run_font(tab_run, font_size=font_sz)
+@lru_cache(maxsize=None)
+def _toc_ppr(level: int) -> str:
+    # Indented 1cm per level, with the dotted tab stop for the page placeholder
+    return _ppr_xml(WD_ALIGN_PARAGRAPH.LEFT, Cm(0), Pt(2), Pt(2), 1.5,
+                    left_indent=Cm((level - 1) * 1.0), extra=_TOC_TAB_STOP_XML)
 
 
-def _add_toc_tab_stop(paragraph) -> None:
-    """Add a right-aligned tab stop with dot leader at the right margin."""
-    pPr = paragraph._p.get_or_add_pPr()
-    tabs = OxmlElement("w:tabs")
-    tab = OxmlElement("w:tab")
-    tab.set(qn("w:val"), "right")
-    tab.set(qn("w:leader"), "dot")
-    # Right margin position (~16.5cm from left margin for A4 with 30mm+15mm margins)
-    tab.set(qn("w:pos"), "9356")  # in twips (16.5cm)
-    tabs.append(tab)
-    pPr.append(tabs)
+_TOC_ENTRY_RPR = {bold: _run_format_xml(font_size=Pt(14), bold=bold) for bold in (False, True)}
+_TOC_TAB_RUN = _run_xml("\t", _run_format_xml(font_size=Pt(14)))
 
 
 # --- Page break ---
 
-def _add_page_break(doc: Document) -> None:
+def _add_page_break(tail: Paragraph) -> None:
     """Add a page break."""
-    doc.add_page_break()
+    tail.insert_paragraph_before().add_run().add_break(WD_BREAK.PAGE)
 
 
 # --- Block rendering ---
 
-def _render_blocks(doc: Document, blocks: list[Block], number_headings: bool = True) -> None:
-    """Render all blocks into the document."""
-    counters = [0, 0, 0]  # H1, H2, H3
+def _render_blocks(tail: Paragraph, blocks: list[Block], section_numbers: list[str] | None = None) -> None:
+    """Render all blocks into the document; headings take ``section_numbers`` in order, if given."""
+    numbers = iter(section_numbers) if section_numbers is not None else None
+    renderers = _RENDERERS
     for block in blocks:
-        if isinstance(block, HeadingBlock):
-            section_number = ""
-            if number_headings:
-                if block.level == 1:
-                    counters[0] += 1
-                    counters[1] = 0
-                    counters[2] = 0
-                    section_number = str(counters[0])
-                elif block.level == 2:
-                    counters[1] += 1
-                    counters[2] = 0
-                    section_number = f"{counters[0]}.{counters[1]}"
-                else:
-                    counters[2] += 1
-                    section_number = f"{counters[0]}.{counters[1]}.{counters[2]}"
-            _render_heading(doc, block, section_number=section_number)
-        elif isinstance(block, ParagraphBlock):
-            _render_paragraph(doc, block)
-        elif isinstance(block, ListBlock):
-            _render_list(doc, block)
-        elif isinstance(block, CodeBlock):
-            _render_code_block(doc, block)
-        elif isinstance(block, TableBlock):
-            _render_table(doc, block)
-        elif isinstance(block, ImageBlock):
-            _render_image(doc, block)
-        elif isinstance(block, BlockquoteBlock):
-            _render_blockquote(doc, block)
-
-
-def _render_heading(doc: Document, block: HeadingBlock, section_number: str = "") -> None:
+        tp = type(block)
+        if tp is HeadingBlock:
+            section_number = next(numbers) if numbers is not None else ""
+            _render_heading(tail, block, section_number=section_number)
+        else:
+            render = renderers.get(tp)
+            if render is not None:
+                render(tail, block)
+
+
+@lru_cache(maxsize=None)
+def _heading_ppr(level: int) -> str:
+    if level == 1:
+        return _ppr_xml(alignment=WD_ALIGN_PARAGRAPH.CENTER, first_line_indent=Cm(0),
+                        space_before=Pt(24), space_after=Pt(12),
+                        extra='<w:outlineLvl w:val="0"/>')
+    return _ppr_xml(alignment=WD_ALIGN_PARAGRAPH.LEFT, first_line_indent=PARAGRAPH_INDENT,
+                    space_before=Pt(18) if level == 2 else Pt(12), space_after=Pt(6),
+                    extra=f'<w:outlineLvl w:val="{min(level - 1, 8)}"/>')
+
+
+_HEADING_RPR = _run_format_xml(font_size=Pt(14), bold=True)
+
+
+def _render_heading(tail: Paragraph, block: HeadingBlock, section_number: str = "") -> None:
     """Render heading with GOST formatting. H1: centered, bold, uppercase. H2+: bold, indented."""
-    p = doc.add_paragraph()
     prefix = f"{section_number} " if section_number else ""
-    if block.level == 1:
-        set_paragraph_format(p, alignment=WD_ALIGN_PARAGRAPH.CENTER,
-                             first_line_indent=Cm(0),
-                             space_before=Pt(24), space_after=Pt(12))
-        run = p.add_run(f"{prefix}{block.text.upper()}")
-        set_run_font(run, font_size=Pt(14), bold=True)
-        _set_heading_outline_level(p, 0)
-    elif block.level == 2:
-        set_paragraph_format(p, alignment=WD_ALIGN_PARAGRAPH.LEFT,
-                             first_line_indent=PARAGRAPH_INDENT,
-                             space_before=Pt(18), space_after=Pt(6))
-        run = p.add_run(f"{prefix}{block.text}")
-        set_run_font(run, font_size=Pt(14), bold=True)
-        _set_heading_outline_level(p, 1)
-    else:
-        set_paragraph_format(p, alignment=WD_ALIGN_PARAGRAPH.LEFT,
-                             first_line_indent=PARAGRAPH_INDENT,
-                             space_before=Pt(12), space_after=Pt(6))
-        run = p.add_run(f"{prefix}{block.text}")
-        set_run_font(run, font_size=Pt(14), bold=True)
-        _set_heading_outline_level(p, min(block.level - 1, 8))
+    text = block.text.upper() if block.level == 1 else block.text
+    _insert_paragraph_xml(tail, _heading_ppr(block.level), _run_xml(f"{prefix}{text}", _HEADING_RPR))
+
+
+_BODY_PPR = _ppr_xml()
+_LIST_PPR = _ppr_xml(first_line_indent=Cm(0), left_indent=PARAGRAPH_INDENT)
+_CODE_LABEL_PPR = _ppr_xml(alignment=WD_ALIGN_PARAGRAPH.LEFT, first_line_indent=Cm(0),
+                           space_before=Pt(6), space_after=Pt(0), line_spacing=1.0,
+                           left_indent=PARAGRAPH_INDENT)
+_CODE_LABEL_RPR = _run_format_xml(font_size=Pt(10), italic=True)
+_CODE_BORDER_XML = (
+    "<w:pBdr>"
+    + "".join(
+        f'<w:{side} w:val="single" w:sz="4" w:space="4" w:color="808080"/>'
+        for side in ("top", "left", "bottom", "right")
+    )
+    + '</w:pBdr><w:shd w:val="clear" w:color="auto" w:fill="F2F2F2"/>'
+)
+_CODE_PPR = {
+    labelled: _ppr_xml(alignment=WD_ALIGN_PARAGRAPH.LEFT, first_line_indent=Cm(0),
+                       space_before=Pt(3) if labelled else Pt(6), space_after=Pt(6),
+                       line_spacing=1.0, left_indent=PARAGRAPH_INDENT, extra=_CODE_BORDER_XML)
+    for labelled in (False, True)
+}
 
 
-def _set_heading_outline_level(paragraph, level: int) -> None:
-    """Set the outline level on a paragraph so it appears in the TOC."""
-    pPr = paragraph._p.get_or_add_pPr()
-    outline = OxmlElement("w:outlineLvl")
-    outline.set(qn("w:val"), str(level))
-    pPr.append(outline)
+_CODE_RPR = _run_format_xml(CODE_FONT_NAME, CODE_FONT_SIZE)
 
 
-def _render_paragraph(doc: Document, block: ParagraphBlock) -> None:
+def _render_paragraph(tail: Paragraph, block: ParagraphBlock) -> None:
     """Render a paragraph with formatted runs."""
-    p = doc.add_paragraph()
-    set_paragraph_format(p)
-    for run_data in block.runs:
-        run = p.add_run(run_data.text)
-        if run_data.code:
-            set_run_font(run, font_name=CODE_FONT_NAME, font_size=CODE_FONT_SIZE)
-        else:
-            set_run_font(run, bold=run_data.bold, italic=run_data.italic)
+    _insert_paragraph_xml(tail, _BODY_PPR, _body_runs_xml(block.runs))
 
 
-def _render_list(doc: Document, block: ListBlock) -> None:
+def _render_list(tail: Paragraph, block: ListBlock) -> None:
     """Render a list (ordered or unordered) with proper indentation."""
+    plain = _run_format_xml()
     for i, item_runs in enumerate(block.items):
-        p = doc.add_paragraph()
-        set_paragraph_format(p, first_line_indent=Cm(0))
-        p.paragraph_format.left_indent = PARAGRAPH_INDENT
-
         if block.ordered:
             prefix = f"{i + 1}. "
         else:
             prefix = "– "
-        run = p.add_run(prefix)
-        set_run_font(run)
-
-        for run_data in item_runs:
-            run = p.add_run(run_data.text)
-            if run_data.code:
-                set_run_font(run, font_name=CODE_FONT_NAME, font_size=CODE_FONT_SIZE)
-            else:
-                set_run_font(run, bold=run_data.bold, italic=run_data.italic)
+        _insert_paragraph_xml(tail, _LIST_PPR, _run_xml(prefix, plain) + _body_runs_xml(item_runs))
 
 
-def _render_code_block(doc: Document, block: CodeBlock) -> None:
+def _render_code_block(tail: Paragraph, block: CodeBlock) -> None:
     """Render a code block with monospace font and border."""
     # Language label
     if block.language:
-        lbl = doc.add_paragraph()
-        set_paragraph_format(lbl, alignment=WD_ALIGN_PARAGRAPH.LEFT,
-                             first_line_indent=Cm(0),
-                             space_before=Pt(6), space_after=Pt(0),
-                             line_spacing=1.0)
-        lbl.paragraph_format.left_indent = PARAGRAPH_INDENT
-        r = lbl.add_run(f"Листинг ({block.language}):")
-        set_run_font(r, font_size=Pt(10), italic=True)
-
-    p = doc.add_paragraph()
-    set_paragraph_format(p, alignment=WD_ALIGN_PARAGRAPH.LEFT,
-                         first_line_indent=Cm(0),
-                         space_before=Pt(3) if block.language else Pt(6),
-                         space_after=Pt(6),
-                         line_spacing=1.0)
-    p.paragraph_format.left_indent = PARAGRAPH_INDENT
-    _add_paragraph_border(p)
-    _add_paragraph_shading(p, "F2F2F2")
-
-    # Split code into lines and use add_break() for proper line breaks
+        _insert_paragraph_xml(tail, _CODE_LABEL_PPR, _run_xml(
+            f"Листинг ({block.language}):", _CODE_LABEL_RPR))
+
+    # One run per code line, each but the last ending in a line break
     lines = block.code.split("\n")
-    for i, line in enumerate(lines):
-        run = p.add_run(line)
-        set_run_font(run, font_name=CODE_FONT_NAME, font_size=CODE_FONT_SIZE)
-        if i < len(lines) - 1:
-            run.add_break()
-
-
-def _add_paragraph_border(paragraph) -> None:
-    """Add a thin border around a paragraph."""
-    pPr = paragraph._p.get_or_add_pPr()
-    pBdr = OxmlElement("w:pBdr")
-    for side in ("top", "left", "bottom", "right"):
-        border = OxmlElement(f"w:{side}")
-        border.set(qn("w:val"), "single")
-        border.set(qn("w:sz"), "4")
-        border.set(qn("w:space"), "4")
-        border.set(qn("w:color"), "808080")
-        pBdr.append(border)
-    pPr.append(pBdr)
-
-
-def _add_paragraph_shading(paragraph, color: str) -> None:
-    """Add background shading to a paragraph."""
-    pPr = paragraph._p.get_or_add_pPr()
-    shd = OxmlElement("w:shd")
-    shd.set(qn("w:val"), "clear")
-    shd.set(qn("w:color"), "auto")
-    shd.set(qn("w:fill"), color)
-    pPr.append(shd)
-
-
-def _render_table(doc: Document, block: TableBlock) -> None:
+    runs_xml = "".join(
+        _run_xml(line, _CODE_RPR, "<w:br/>" if i < len(lines) - 1 else "")
+        for i, line in enumerate(lines)
+    )
+    _insert_paragraph_xml(tail, _CODE_PPR[bool(block.language)], runs_xml)
+
+
+_CELL_PPR = _ppr_xml(WD_ALIGN_PARAGRAPH.CENTER, Cm(0))
+_CELL_RPR = _run_format_xml(font_size=TABLE_FONT_SIZE)
+_HEADER_CELL_RPR = _run_format_xml(font_size=TABLE_FONT_SIZE, bold=True)
+
+
+def _render_table(tail: Paragraph, block: TableBlock) -> None:
     """Render a table with borders and centered alignment."""
     num_cols = len(block.headers) if block.headers else (len(block.rows[0]) if block.rows else 0)
     if num_cols == 0:
         return
 
     num_rows = (1 if block.headers else 0) + len(block.rows)
-    table = doc.add_table(rows=num_rows, cols=num_cols)
+    tbl = CT_Tbl.new_tbl(num_rows, num_cols, CONTENT_WIDTH)
+    tail._p.addprevious(tbl)
+    table = Table(tbl, tail._parent)
     table.alignment = WD_TABLE_ALIGNMENT.CENTER
     _set_table_borders(table)
 
-    row_idx = 0
-    if block.headers:
-        for col_idx, header in enumerate(block.headers):
-            cell = table.cell(0, col_idx)
-            p = cell.paragraphs[0]
-            set_paragraph_format(p, alignment=WD_ALIGN_PARAGRAPH.CENTER, first_line_indent=Cm(0))
-            run = p.add_run(header)
-            set_run_font(run, font_size=TABLE_FONT_SIZE, bold=True)
-        row_idx = 1
-
-    for row_data in block.rows:
-        for col_idx, cell_text in enumerate(row_data):
-            if col_idx >= num_cols:
-                break
-            cell = table.cell(row_idx, col_idx)
-            p = cell.paragraphs[0]
-            set_paragraph_format(p, alignment=WD_ALIGN_PARAGRAPH.CENTER, first_line_indent=Cm(0))
-            run = p.add_run(cell_text)
-            set_run_font(run, font_size=TABLE_FONT_SIZE)
-        row_idx += 1
-
-
-def _render_image(doc: Document, block: ImageBlock) -> None:
-    """Render an image block. Downloads from URL if available."""
-    image_data = _download_image(block.url)
+    # Fill cells through the tr/tc elements directly: Table.cell() rebuilds the
+    # whole cell grid on every call
+    rows = [(block.headers, _HEADER_CELL_RPR)] if block.headers else []
+    rows.extend((row_data, _CELL_RPR) for row_data in block.rows)
+    for tr, (row_data, rpr) in zip(tbl.tr_lst, rows):
+        for tc, cell_text in zip(tr.tc_lst, row_data):
+            tc.replace(tc.p_lst[0], parse_xml(
+                f"<w:p {_W}>{_CELL_PPR}{_run_xml(cell_text, rpr)}</w:p>"))
+
+
+_CAPTION_PPR = _ppr_xml(WD_ALIGN_PARAGRAPH.CENTER, Cm(0), Pt(2), Pt(6))
+_CAPTION_RPR = _run_format_xml(font_size=Pt(12), italic=True)
+_PLACEHOLDER_RPR = _run_format_xml(italic=True)
+_IMAGE_WIDTH = Cm(14)
+
+
+def _render_image(tail: Paragraph, block: ImageBlock) -> None:
+    """Render an image block. Uses prefetched bytes, else downloads from URL if available."""
+    if block.data is not None:
+        image_data = io.BytesIO(block.data) if block.data else None
+    else:
+        data = _download_image(block.url)
+        image_data = io.BytesIO(data) if data else None
     if image_data:
-        doc.add_picture(image_data, width=Cm(14))
-        last_para = doc.paragraphs[-1]
-        last_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        pic_para = tail.insert_paragraph_before()
+        pic_para.add_run().add_picture(image_data, width=_IMAGE_WIDTH)
+        pic_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
     else:
-        p = doc.add_paragraph()
-        set_paragraph_format(p, alignment=WD_ALIGN_PARAGRAPH.CENTER, first_line_indent=Cm(0))
-        run = p.add_run(f"[Изображение: {block.alt or block.url}]")
-        set_run_font(run, italic=True)
+        _insert_paragraph_xml(tail, _CELL_PPR, _run_xml(
+            f"[Изображение: {block.alt or block.url}]", _PLACEHOLDER_RPR))
     if block.alt:
-        p = doc.add_paragraph()
-        set_paragraph_format(p, alignment=WD_ALIGN_PARAGRAPH.CENTER,
-                             first_line_indent=Cm(0),
-                             space_before=Pt(2), space_after=Pt(6))
-        run = p.add_run(block.alt)
-        set_run_font(run, font_size=Pt(12), italic=True)
-
-
-def _download_image(url: str) -> io.BytesIO | None:
-    """Try to download an image from URL. Returns BytesIO or None on failure."""
+        _insert_paragraph_xml(tail, _CAPTION_PPR, _run_xml(
+            block.alt, _CAPTION_RPR))
+
+
+IMAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024  # downloaded images kept by URL, least recently used evicted first
+IMAGE_MAX_BYTES = 5 * 1024 * 1024
+
+
+# Leading bytes of the formats python-docx can embed (PNG, JPEG, GIF, BMP, TIFF)
+_IMAGE_SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a", b"BM",
+                     b"II*\x00", b"MM\x00*")
+
+# Filled from prefetch worker threads, hence the lock
+_image_cache: OrderedDict[str, bytes] = OrderedDict()
+_image_cache_bytes = 0
+_image_cache_lock = threading.Lock()
+
+
+def _fetch_image(url: str) -> bytes:
+    """Download an image (max IMAGE_MAX_BYTES). Raises on failure."""
+    import urllib.request
+    req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        length = resp.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > IMAGE_MAX_BYTES:
+            raise ValueError(f"image too large: {length} bytes")
+        data = resp.read(IMAGE_MAX_BYTES + 1)
+    if len(data) > IMAGE_MAX_BYTES:
+        raise ValueError("image too large")
+    if not data.startswith(_IMAGE_SIGNATURES):
+        raise ValueError("not a supported image")
+    return data
+
+
+def _cached_image(url: str) -> bytes:
+    """_fetch_image with an LRU cache bounded by IMAGE_CACHE_MAX_BYTES; failures are not cached."""
+    global _image_cache_bytes
+    with _image_cache_lock:
+        data = _image_cache.get(url)
+        if data is not None:
+            _image_cache.move_to_end(url)
+            return data
+    data = _fetch_image(url)
+    with _image_cache_lock:
+        if url not in _image_cache:
+            _image_cache[url] = data
+            _image_cache_bytes += len(data)
+            while _image_cache_bytes > IMAGE_CACHE_MAX_BYTES:
+                _, evicted = _image_cache.popitem(last=False)
+                _image_cache_bytes -= len(evicted)
+    return data
+
+
+def _download_image(url: str) -> bytes | None:
+    """Try to download an image from URL. Returns bytes or None on failure; cached by URL."""
     if not url or not url.startswith(("http://", "https://")):
         return None
     try:
-        import urllib.request
-        req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = resp.read(5 * 1024 * 1024)  # max 5MB
-        return io.BytesIO(data)
+        return _cached_image(url)
     except Exception:
         return None
 
 
-def _render_blockquote(doc: Document, block: BlockquoteBlock) -> None:
+async def prefetch_images(blocks: list[Block]) -> list[Block]:
+    """Download all block images concurrently ahead of build_docx.
+
+    Each unique URL is fetched once in a worker thread. Returns a new block list in
+    which each ImageBlock is replaced by a copy carrying its bytes; ``blocks`` itself
+    is left untouched, since it may be shared with the parse cache.
+    """
+    urls = list(dict.fromkeys(b.url for b in blocks if type(b) is ImageBlock and b.data is None))
+    if not urls:
+        return blocks
+    results = await asyncio.gather(*(asyncio.to_thread(_download_image, url) for url in urls))
+    fetched = {url: data or b"" for url, data in zip(urls, results)}
+    return [
+        replace(b, data=fetched[b.url]) if type(b) is ImageBlock and b.data is None else b
+        for b in blocks
+    ]
+
+
+_QUOTE_PPR = _ppr_xml(first_line_indent=Cm(0), space_before=Pt(6), space_after=Pt(6),
+                     left_indent=Cm(2))
+
+
+def _render_blockquote(tail: Paragraph, block: BlockquoteBlock) -> None:
     """Render a blockquote with increased indent and italic."""
-    p = doc.add_paragraph()
-    set_paragraph_format(p, first_line_indent=Cm(0),
-                         space_before=Pt(6), space_after=Pt(6))
-    p.paragraph_format.left_indent = Cm(2)
-    for run_data in block.runs:
-        run = p.add_run(run_data.text)
-        set_run_font(run, italic=True, bold=run_data.bold)
+    _insert_paragraph_xml(tail, _QUOTE_PPR, "".join(
+        _run_xml(r.text, _run_format_xml(italic=True, bold=r.bold)) for r in block.runs
+    ))
+
+
+# Block type → renderer(tail, block); headings are handled in _render_blocks,
+# which threads the section numbers through
+_RENDERERS = {
+    ParagraphBlock: _render_paragraph,
+    ListBlock: _render_list,
+    CodeBlock: _render_code_block,
+    TableBlock: _render_table,
+    ImageBlock: _render_image,
+    BlockquoteBlock: _render_blockquote,
+}
 
 
 def _set_table_borders(table) -> None:
     """Apply borders to all cells in a table."""
     tbl = table._tbl
     tblPr = tbl.tblPr if tbl.tblPr is not None else OxmlElement("w:tblPr")
-    borders = OxmlElement("w:tblBorders")
-    for side in ("top", "left", "bottom", "right", "insideH", "insideV"):
-        border = OxmlElement(f"w:{side}")
-        border.set(qn("w:val"), "single")
-        border.set(qn("w:sz"), "4")
-        border.set(qn("w:space"), "0")
-        border.set(qn("w:color"), "000000")
-        borders.append(border)
-    tblPr.append(borders)
+    tblPr.append(deepcopy(_TABLE_BORDERS))
 
 
 # --- Page numbering ---
@@ -548,7 +751,7 @@ def _add_page_numbers(doc: Document) -> None:
     run3._r.append(fldChar2)
 
     run4 = p.add_run("1")
-    set_run_font(run4, font_size=FONT_SIZE)
+    _set_run_format(run4, font_size=FONT_SIZE)
 
     run5 = p.add_run()
     fldChar3 = OxmlElement("w:fldChar")
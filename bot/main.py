@@ -3,29 +3,45 @@
 from __future__ import annotations
 
 import asyncio
+import dataclasses
+import hashlib
+import io
 import logging
 import os
 import re
+import weakref
+from collections import OrderedDict
+from operator import attrgetter
 from pathlib import Path
 
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     ConversationHandler,
     ContextTypes,
+    TypeHandler,
     filters,
 )
 
+try:
+    import uvloop  # libuv-based event loop: faster socket I/O than the default asyncio loop
+except ImportError:  # not available on Windows
+    uvloop = None
+
 from bot.converter import parse_markdown, Metadata
-from bot.docx_builder import build_docx
+from bot.docx_builder import build_docx_async, prefetch_images
 from bot.styles import WORK_TYPES
-from bot.ai_processor import extract_text, generate_report
+from bot.ai_processor import extract_text_async, generate_report
 
 load_dotenv()
+# The environment is fixed once .env is loaded, so /report checks this instead of os.environ
+_HAS_GEMINI = bool(os.getenv("GEMINI_API_KEY"))
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO,
@@ -34,16 +50,40 @@ logger = logging.getLogger(__name__)
 
 TEMPLATES_DIR = Path(__file__).parent / "templates"
 MAX_FILE_SIZE = 1 * 1024 * 1024  # 1 MB
+# Accepted upload extensions (lower-case): Markdown input, and /report source documents
+MARKDOWN_EXTENSIONS = frozenset({".md", ".markdown", ".txt"})
+REPORT_EXTENSIONS = frozenset({".docx", ".pdf", ".txt"})
+# Updates handled at once across different users; each user's own updates stay in order
+CONCURRENT_UPDATES = 32
+MAX_TEXT_CHARS = 500_000  # longer Markdown or /report source text is rejected before any processing
+PARSE_IN_THREAD_CHARS = 16384  # Markdown longer than this is parsed off the event loop
+PARSE_CACHE_SIZE = 32  # recently parsed documents kept, so resending the same text skips parsing
+PARSE_CACHE_MAX_CHARS = 256 * 1024  # larger inputs are not cached
+# Abandoned conversations are ended (and their parsed document dropped) after this long idle
+CONVERSATION_TIMEOUT_S = 30 * 60
+REPORT_PREVIEW_CHARS = 3500  # tail of the streamed report shown while generating (Telegram limit is 4096)
+# Anything but word characters (Cyrillic included), spaces and dashes becomes "_" in file names
+_UNSAFE_FILENAME_RE = re.compile(r"[^\w \-]")
+# Text messages shorter than this must contain some Markdown markup to be parsed at all
+PLAIN_TEXT_MAX_CHARS = 200
+# Leading whitespace is [ \t]* rather than \s*, so a line-start match never scans past its own line
+_MARKDOWN_HINT_RE = re.compile(r"(?m)^[ \t]*(?:[-*+#>|]|\d+\.\s|```|---)|[*_`|#]")
+
+# Example template, read once at startup; None if the file is missing
+try:
+    _TEMPLATE_BYTES: bytes | None = (TEMPLATES_DIR / "example.md").read_bytes()
+except OSError:
+    _TEMPLATE_BYTES = None
 
 # Conversation states
 EDIT_META, EDITING_FIELD, REPORT_INPUT = range(3)
 
 # user_data keys
-KEY_MD_TEXT = "md_text"
 KEY_METADATA = "metadata"
 KEY_BLOCKS = "blocks"
 KEY_WORK_TYPE = "work_type"
 KEY_EDITING_FIELD = "editing_field"
+KEY_DASHBOARD = "dashboard"  # (field values, work type) → last rendered dashboard text
 
 # Editable metadata fields: key → (display label, input prompt)
 META_FIELDS = {
@@ -66,57 +106,65 @@ WORK_TYPE_LABELS = {
 
 # --- Dashboard ---
 
-def _build_dashboard_text(meta: Metadata, work_type: str) -> str:
-    """Build the metadata dashboard message text."""
-    wt_label = WORK_TYPE_LABELS.get(work_type, "—")
-    return (
-        "Данные титульного листа:\n\n"
-        f"Тип работы: {wt_label}\n"
-        f"Название: {meta.title or '—'}\n"
-        f"Студент: {meta.author or '—'}\n"
-        f"Группа: {meta.group or '—'}\n"
-        f"Преподаватель: {meta.teacher or '—'}\n"
-        f"Предмет: {meta.subject or '—'}\n"
-        f"Номер работы: {meta.work_number or '—'}\n"
-        "\nНажмите на поле, чтобы изменить значение."
-    )
+# Dashboard layout: one line per field in META_FIELDS, filled in by _build_dashboard_text
+_DASHBOARD_TEMPLATE = (
+    "Данные титульного листа:\n\n"
+    "Тип работы: {work_type}\n"
+    + "".join(f"{label}: {{{key}}}\n" for key, (label, _) in META_FIELDS.items())
+    + "\nНажмите на поле, чтобы изменить значение."
+)
 
 
-def _build_dashboard_keyboard() -> InlineKeyboardMarkup:
-    """Build the inline keyboard for the metadata dashboard."""
-    buttons = [
-        [
-            InlineKeyboardButton("Тип работы", callback_data="field:work_type"),
-            InlineKeyboardButton("Название", callback_data="field:title"),
-        ],
-        [
-            InlineKeyboardButton("Студент", callback_data="field:author"),
-            InlineKeyboardButton("Группа", callback_data="field:group"),
-        ],
-        [
-            InlineKeyboardButton("Преподаватель", callback_data="field:teacher"),
-            InlineKeyboardButton("Предмет", callback_data="field:subject"),
-        ],
-        [
-            InlineKeyboardButton("Номер работы", callback_data="field:work_number"),
-        ],
-        [
-            InlineKeyboardButton("Сгенерировать DOCX", callback_data="meta:generate"),
-        ],
-        [
-            InlineKeyboardButton("Отмена", callback_data="meta:cancel"),
-        ],
-    ]
-    return InlineKeyboardMarkup(buttons)
+_dashboard_values = attrgetter(*META_FIELDS)
 
 
-def _work_type_keyboard() -> InlineKeyboardMarkup:
-    buttons = [
-        [InlineKeyboardButton(label, callback_data=f"wt:{key}")]
-        for key, label in WORK_TYPE_LABELS.items()
-    ]
-    buttons.append([InlineKeyboardButton("Назад", callback_data="wt:back")])
-    return InlineKeyboardMarkup(buttons)
+def _build_dashboard_text(meta: Metadata, work_type: str) -> str:
+    """Build the metadata dashboard message text."""
+    values = {key: getattr(meta, key) or "—" for key in META_FIELDS}
+    values["work_type"] = WORK_TYPE_LABELS.get(work_type, "—")
+    return _DASHBOARD_TEMPLATE.format_map(values)
+
+
+def _dashboard_text(context: ContextTypes.DEFAULT_TYPE, meta: Metadata, work_type: str) -> str:
+    """Dashboard text, reusing the user's last render when nothing shown on it changed."""
+    key = (_dashboard_values(meta), work_type)
+    cached = context.user_data.get(KEY_DASHBOARD)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    text = _build_dashboard_text(meta, work_type)
+    context.user_data[KEY_DASHBOARD] = (key, text)
+    return text
+
+
+# Static: telegram objects are immutable, so one instance is shared by every dashboard
+_DASHBOARD_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Тип работы", callback_data="field:work_type"),
+        InlineKeyboardButton("Название", callback_data="field:title"),
+    ],
+    [
+        InlineKeyboardButton("Студент", callback_data="field:author"),
+        InlineKeyboardButton("Группа", callback_data="field:group"),
+    ],
+    [
+        InlineKeyboardButton("Преподаватель", callback_data="field:teacher"),
+        InlineKeyboardButton("Предмет", callback_data="field:subject"),
+    ],
+    [
+        InlineKeyboardButton("Номер работы", callback_data="field:work_number"),
+    ],
+    [
+        InlineKeyboardButton("Сгенерировать DOCX", callback_data="meta:generate"),
+    ],
+    [
+        InlineKeyboardButton("Отмена", callback_data="meta:cancel"),
+    ],
+])
+
+_WORK_TYPE_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(label, callback_data=f"wt:{key}")] for key, label in WORK_TYPE_LABELS.items()]
+    + [[InlineKeyboardButton("Назад", callback_data="wt:back")]]
+)
 
 
 # --- Standalone commands (outside conversation) ---
@@ -166,20 +214,54 @@ async def help_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 
 async def template_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    template_path = TEMPLATES_DIR / "example.md"
-    if template_path.exists():
-        with open(template_path, "rb") as f:
-            await update.message.reply_document(
-                document=f,
-                filename="example.md",
-                caption="Пример шаблона лабораторной работы. Отредактируйте и отправьте обратно.",
-            )
+    if _TEMPLATE_BYTES is not None:
+        await update.message.reply_document(
+            document=io.BytesIO(_TEMPLATE_BYTES),
+            filename="example.md",
+            caption="Пример шаблона лабораторной работы. Отредактируйте и отправьте обратно.",
+        )
     else:
         await update.message.reply_text("Шаблон не найден.")
 
 
 # --- Conversation: text input → dashboard ---
 
+_parse_cache: OrderedDict[bytes, tuple] = OrderedDict()
+
+
+async def _parse_markdown(md_text: str):
+    """parse_markdown with an LRU cache by content hash.
+
+    Large inputs are parsed in a worker thread, small ones inline. Each caller gets
+    its own Metadata copy, since dashboard edits modify it in place; the cached blocks
+    are shared and must not be mutated (prefetch_images returns copies instead).
+    Raises ValueError (with a message for the user) for text over MAX_TEXT_CHARS.
+    """
+    if len(md_text) > MAX_TEXT_CHARS:
+        raise ValueError(
+            f"Текст слишком длинный (максимум {MAX_TEXT_CHARS} символов)."
+        )
+    key = None
+    if len(md_text) <= PARSE_CACHE_MAX_CHARS:
+        key = hashlib.blake2b(md_text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        cached = _parse_cache.get(key)
+        if cached is not None:
+            _parse_cache.move_to_end(key)
+            meta, blocks = cached
+            return dataclasses.replace(meta), list(blocks)
+
+    if len(md_text) > PARSE_IN_THREAD_CHARS:
+        meta, blocks = await asyncio.to_thread(parse_markdown, md_text)
+    else:
+        meta, blocks = parse_markdown(md_text)
+
+    if key is not None:
+        _parse_cache[key] = (meta, tuple(blocks))
+        if len(_parse_cache) > PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    return dataclasses.replace(meta), list(blocks)
+
+
 async def text_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle plain text messages as Markdown input."""
     md_text = update.message.text
@@ -187,8 +269,16 @@ async def text_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await update.message.reply_text("Сообщение слишком короткое. Отправьте Markdown-текст.")
         return ConversationHandler.END
 
+    # Casual chatter ("привет") is answered with a hint instead of becoming a one-paragraph document
+    if len(md_text) < PLAIN_TEXT_MAX_CHARS and not _MARKDOWN_HINT_RE.search(md_text):
+        await update.message.reply_text(
+            "Это не похоже на Markdown. Отправьте текст с заголовками (# ...) "
+            "или воспользуйтесь /template, чтобы получить пример."
+        )
+        return ConversationHandler.END
+
     try:
-        metadata, blocks = parse_markdown(md_text)
+        metadata, blocks = await _parse_markdown(md_text)
     except ValueError as e:
         await update.message.reply_text(str(e))
         return ConversationHandler.END
@@ -200,9 +290,7 @@ async def text_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         )
         return ConversationHandler.END
 
-    context.user_data[KEY_MD_TEXT] = md_text
-    context.user_data[KEY_METADATA] = metadata
-    context.user_data[KEY_BLOCKS] = blocks
+    context.user_data.update({KEY_METADATA: metadata, KEY_BLOCKS: blocks})
     context.user_data.setdefault(KEY_WORK_TYPE, "lab")
 
     return await _send_dashboard(update.message, context)
@@ -222,8 +310,7 @@ async def document_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return ConversationHandler.END
 
-    name = (doc.file_name or "").lower()
-    if not (name.endswith(".md") or name.endswith(".txt") or name.endswith(".markdown")):
+    if os.path.splitext(doc.file_name or "")[1].lower() not in MARKDOWN_EXTENSIONS:
         await update.message.reply_text(
             "Поддерживаются файлы .md, .markdown и .txt.\n"
             "Отправьте файл в одном из этих форматов."
@@ -231,11 +318,20 @@ async def document_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ConversationHandler.END
 
     file = await doc.get_file()
-    data = await file.download_as_bytearray()
-    md_text = data.decode("utf-8", errors="replace")
+    # The message may omit file_size; getFile reports it, so check again before downloading
+    if file.file_size and file.file_size > MAX_FILE_SIZE:
+        await update.message.reply_text(
+            "Файл слишком большой (максимум 1 МБ). Отправьте файл меньшего размера."
+        )
+        return ConversationHandler.END
+    buf = io.BytesIO()
+    await file.download_to_memory(buf)
+    # Decode straight from the buffer, without a bytes copy in between
+    with buf.getbuffer() as view:
+        md_text = str(view, "utf-8", "replace")
 
     try:
-        metadata, blocks = parse_markdown(md_text)
+        metadata, blocks = await _parse_markdown(md_text)
     except ValueError as e:
         await update.message.reply_text(str(e))
         return ConversationHandler.END
@@ -247,9 +343,7 @@ async def document_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return ConversationHandler.END
 
-    context.user_data[KEY_MD_TEXT] = md_text
-    context.user_data[KEY_METADATA] = metadata
-    context.user_data[KEY_BLOCKS] = blocks
+    context.user_data.update({KEY_METADATA: metadata, KEY_BLOCKS: blocks})
     context.user_data.setdefault(KEY_WORK_TYPE, "lab")
 
     await update.message.reply_text("Файл получен!")
@@ -262,11 +356,16 @@ async def _send_dashboard(message, context: ContextTypes.DEFAULT_TYPE, edit: boo
     """Send or edit the metadata dashboard message."""
     meta: Metadata = context.user_data.get(KEY_METADATA, Metadata())
     work_type = context.user_data.get(KEY_WORK_TYPE, "lab")
-    text = _build_dashboard_text(meta, work_type)
-    keyboard = _build_dashboard_keyboard()
+    text = _dashboard_text(context, meta, work_type)
+    keyboard = _DASHBOARD_KEYBOARD
 
     if edit:
-        await message.edit_text(text, reply_markup=keyboard)
+        # Telegram rejects an edit that would change nothing; the message is already right then
+        try:
+            await message.edit_text(text, reply_markup=keyboard)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
     else:
         await message.reply_text(text, reply_markup=keyboard)
     return EDIT_META
@@ -274,42 +373,34 @@ async def _send_dashboard(message, context: ContextTypes.DEFAULT_TYPE, edit: boo
 
 # --- Dashboard button handlers ---
 
-async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle all button presses on the dashboard."""
-    query = update.callback_query
-    await query.answer()
-    data = query.data or ""
-
-    # Field edit button
-    if data.startswith("field:"):
-        field_key = data[6:]
-
-        # Work type gets its own keyboard
-        if field_key == "work_type":
-            await query.edit_message_text(
-                "Выберите тип работы:",
-                reply_markup=_work_type_keyboard(),
-            )
-            return EDIT_META
+async def _on_field_button(query, context: ContextTypes.DEFAULT_TYPE, field_key: str) -> int:
+    # Work type gets its own keyboard
+    if field_key == "work_type":
+        await query.edit_message_text(
+            "Выберите тип работы:",
+            reply_markup=_WORK_TYPE_KEYBOARD,
+        )
+        return EDIT_META
+
+    # Text field — ask for input
+    if field_key in META_FIELDS:
+        _, prompt = META_FIELDS[field_key]
+        context.user_data[KEY_EDITING_FIELD] = field_key
+        await query.edit_message_text(f"{prompt}\n\n/cancel — отмена")
+        return EDITING_FIELD
+    return EDIT_META
+
+
+async def _on_work_type_button(query, context: ContextTypes.DEFAULT_TYPE, wt: str) -> int:
+    if wt in WORK_TYPES:
+        context.user_data[KEY_WORK_TYPE] = wt
+    # "back" and unknown values just redraw the dashboard
+    return await _send_dashboard(query.message, context, edit=True)
 
-        # Text field — ask for input
-        if field_key in META_FIELDS:
-            _, prompt = META_FIELDS[field_key]
-            context.user_data[KEY_EDITING_FIELD] = field_key
-            await query.edit_message_text(f"{prompt}\n\n/cancel — отмена")
-            return EDITING_FIELD
-
-    # Work type selection
-    if data.startswith("wt:"):
-        wt = data[3:]
-        if wt == "back":
-            return await _send_dashboard(query.message, context, edit=True)
-        if wt in WORK_TYPES:
-            context.user_data[KEY_WORK_TYPE] = wt
-        return await _send_dashboard(query.message, context, edit=True)
 
+async def _on_meta_button(query, context: ContextTypes.DEFAULT_TYPE, action: str) -> int:
     # Generate
-    if data == "meta:generate":
+    if action == "generate":
         meta: Metadata = context.user_data.get(KEY_METADATA, Metadata())
         if not meta.author:
             await query.answer("Заполните ФИО студента!", show_alert=True)
@@ -317,28 +408,53 @@ async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if not meta.teacher:
             await query.answer("Заполните ФИО преподавателя!", show_alert=True)
             return EDIT_META
-        await query.edit_message_text("Генерирую документ...")
-        return await _generate_and_send(query.message, context)
+        return await _generate_and_send(
+            query.message, context,
+            query.answer(), query.edit_message_text("Генерирую документ..."),
+        )
 
     # Cancel
-    if data == "meta:cancel":
+    if action == "cancel":
         await query.edit_message_text("Отменено. Отправьте Markdown заново.")
         context.user_data.clear()
         return ConversationHandler.END
-
     return EDIT_META
 
 
+# callback_data prefix (before ":") → handler(query, context, rest)
+_DASHBOARD_ACTIONS = {
+    "field": _on_field_button,
+    "wt": _on_work_type_button,
+    "meta": _on_meta_button,
+}
+
+
+async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle all button presses on the dashboard."""
+    query = update.callback_query
+    prefix, _, arg = (query.data or "").partition(":")
+    handler = _DASHBOARD_ACTIONS.get(prefix)
+    if handler is None:
+        await query.answer()
+        return EDIT_META
+    if query.data == "meta:generate":
+        # Answers the query itself: with an alert when required fields are missing
+        return await handler(query, context, arg)
+    # The answer and the handler's message edit are independent round-trips
+    _, state = await asyncio.gather(query.answer(), handler(query, context, arg))
+    return state
+
+
 async def field_text_received(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receive text input for a metadata field and return to dashboard."""
     field_key = context.user_data.pop(KEY_EDITING_FIELD, None)
     value = update.message.text.strip()
 
-    if field_key and value:
+    # Only dashboard fields are editable; KEY_EDITING_FIELD is always one of them
+    if value and field_key in META_FIELDS:
         meta: Metadata = context.user_data.get(KEY_METADATA, Metadata())
-        if hasattr(meta, field_key):
-            setattr(meta, field_key, value)
-            context.user_data[KEY_METADATA] = meta
+        setattr(meta, field_key, value)
+        context.user_data[KEY_METADATA] = meta
 
     return await _send_dashboard(update.message, context)
 
@@ -347,7 +463,7 @@ async def field_text_received(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def report_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Entry point for /report command."""
-    if not os.getenv("GEMINI_API_KEY"):
+    if not _HAS_GEMINI:
         await update.message.reply_text(
             "API ключ Gemini не настроен. Добавьте GEMINI_API_KEY в .env файл."
         )
@@ -365,12 +481,20 @@ async def _process_report(text: str, message, context: ContextTypes.DEFAULT_TYPE
     if len(text.strip()) < 10:
         await message.reply_text("Недостаточно материала для генерации отчёта (минимум 10 символов).")
         return ConversationHandler.END
+    if len(text) > MAX_TEXT_CHARS:
+        await message.reply_text(
+            f"Слишком много материала (максимум {MAX_TEXT_CHARS} символов)."
+        )
+        return ConversationHandler.END
 
     status_msg = await message.reply_text("Генерирую отчёт...")
 
+    async def show_progress(partial: str) -> None:
+        await status_msg.edit_text(f"Генерирую отчёт...\n\n{partial[-REPORT_PREVIEW_CHARS:]}")
+
     try:
         work_type = context.user_data.get(KEY_WORK_TYPE, "lab")
-        ai_markdown = await generate_report(text, work_type)
+        ai_markdown = await generate_report(text, work_type, on_progress=show_progress)
     except RuntimeError as e:
         await status_msg.edit_text(f"Ошибка: {e}")
         return ConversationHandler.END
@@ -384,7 +508,7 @@ async def _process_report(text: str, message, context: ContextTypes.DEFAULT_TYPE
         return ConversationHandler.END
 
     try:
-        metadata, blocks = parse_markdown(ai_markdown)
+        metadata, blocks = await _parse_markdown(ai_markdown)
     except ValueError as e:
         await status_msg.edit_text(f"Ошибка разбора результата: {e}")
         return ConversationHandler.END
@@ -393,9 +517,7 @@ async def _process_report(text: str, message, context: ContextTypes.DEFAULT_TYPE
         await status_msg.edit_text("Не удалось сгенерировать отчёт.")
         return ConversationHandler.END
 
-    context.user_data[KEY_MD_TEXT] = ai_markdown
-    context.user_data[KEY_METADATA] = metadata
-    context.user_data[KEY_BLOCKS] = blocks
+    context.user_data.update({KEY_METADATA: metadata, KEY_BLOCKS: blocks})
     context.user_data.setdefault(KEY_WORK_TYPE, "lab")
 
     await status_msg.edit_text("Отчёт сгенерирован!")
@@ -419,16 +541,21 @@ async def report_file_received(update: Update, context: ContextTypes.DEFAULT_TYP
         return REPORT_INPUT
 
     name = doc.file_name or ""
-    name_lower = name.lower()
-    if not (name_lower.endswith(".docx") or name_lower.endswith(".pdf") or name_lower.endswith(".txt")):
+    if os.path.splitext(name)[1].lower() not in REPORT_EXTENSIONS:
         await update.message.reply_text("Поддерживаются файлы .docx, .pdf, .txt.")
         return REPORT_INPUT
 
     file = await doc.get_file()
-    data = bytes(await file.download_as_bytearray())
+    # The message may omit file_size; getFile reports it, so check again before downloading
+    if file.file_size and file.file_size > MAX_FILE_SIZE:
+        await update.message.reply_text("Файл слишком большой (максимум 1 МБ).")
+        return REPORT_INPUT
+    buf = io.BytesIO()
+    await file.download_to_memory(buf)
+    data = buf.getvalue()
 
     try:
-        text = extract_text(data, name)
+        text = await extract_text_async(data, name)
     except Exception:
         logger.exception("Text extraction error")
         await update.message.reply_text("Не удалось извлечь текст из файла.")
@@ -443,17 +570,33 @@ async def report_file_received(update: Update, context: ContextTypes.DEFAULT_TYP
 
 # --- Generate ---
 
-async def _generate_and_send(message, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Build DOCX and send it back."""
+async def _build_document(blocks: list, meta: Metadata, work_type: str) -> io.BytesIO:
+    blocks = await prefetch_images(blocks)
+    # CPU-bound: build in a worker process so other users' updates keep being served
+    return await build_docx_async(blocks, meta, work_type)
+
+
+async def _generate_and_send(message, context: ContextTypes.DEFAULT_TYPE, *status) -> int:
+    """Build DOCX and send it back.
+
+    ``status`` are Telegram calls (e.g. a "generating..." edit) sent while the document
+    builds. Their failures are only logged, and they are cancelled if the build fails,
+    so they cannot overwrite the error message.
+    """
     meta: Metadata = context.user_data.get(KEY_METADATA, Metadata())
     blocks = context.user_data.get(KEY_BLOCKS, [])
     work_type = context.user_data.get(KEY_WORK_TYPE, "lab")
 
+    status_tasks = [asyncio.ensure_future(call) for call in status]
     try:
-        docx_buf = build_docx(blocks, meta, work_type)
+        docx_buf = await _build_document(blocks, meta, work_type)
+        # The status edit lands before the document is sent
+        for result in await asyncio.gather(*status_tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.warning("Status update failed: %s", result)
 
         title = meta.title or "document"
-        safe_title = re.sub(r'[^\w \-]', '_', title).strip() or "document"
+        safe_title = _UNSAFE_FILENAME_RE.sub("_", title).strip() or "document"
         filename = f"{safe_title}.docx"
 
         await message.reply_document(
@@ -463,13 +606,13 @@ async def _generate_and_send(message, context: ContextTypes.DEFAULT_TYPE) -> int
         )
     except Exception:
         logger.exception("Error generating DOCX")
+        for task in status_tasks:
+            task.cancel()
+        await asyncio.gather(*status_tasks, return_exceptions=True)
         await message.reply_text("Ошибка при генерации документа. Проверьте формат Markdown.")
     finally:
-        context.user_data.pop(KEY_MD_TEXT, None)
-        context.user_data.pop(KEY_METADATA, None)
-        context.user_data.pop(KEY_BLOCKS, None)
-        context.user_data.pop(KEY_WORK_TYPE, None)
-        context.user_data.pop(KEY_EDITING_FIELD, None)
+        # user_data only ever holds this conversation's KEY_* entries
+        context.user_data.clear()
 
     return ConversationHandler.END
 
@@ -481,20 +624,61 @@ async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     return ConversationHandler.END
 
 
+async def timeout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Free the parsed document of a conversation that timed out."""
+    context.user_data.clear()
+
+
 async def template_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle inline button for template download."""
     query = update.callback_query
-    await query.answer()
-    template_path = TEMPLATES_DIR / "example.md"
-    if template_path.exists():
-        with open(template_path, "rb") as f:
-            await query.message.reply_document(
-                document=f,
-                filename="example.md",
-                caption="Пример шаблона. Отредактируйте и отправьте обратно.",
-            )
+    if _TEMPLATE_BYTES is not None:
+        reply = query.message.reply_document(
+            document=io.BytesIO(_TEMPLATE_BYTES),
+            filename="example.md",
+            caption="Пример шаблона. Отредактируйте и отправьте обратно.",
+        )
     else:
-        await query.message.reply_text("Шаблон не найден.")
+        reply = query.message.reply_text("Шаблон не найден.")
+    await asyncio.gather(query.answer(), reply)
+
+
+class _PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently, but one at a time per user.
+
+    ConversationHandler state and user_data are not safe against two updates of the
+    same user running at once (e.g. a field typed while "generate" is still running),
+    so those wait on a per-user lock; different users proceed in parallel.
+    """
+
+    __slots__ = ("_locks",)
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # Entries disappear once no update of that user holds or awaits the lock
+        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = None
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                key = update.effective_user.id
+            elif update.effective_chat is not None:
+                key = ("chat", update.effective_chat.id)
+        if key is None:
+            await coroutine
+            return
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        async with lock:
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
 
 
 def main() -> None:
@@ -502,7 +686,12 @@ def main() -> None:
     if not token:
         raise RuntimeError("BOT_TOKEN is not set. Create a .env file with BOT_TOKEN=...")
 
-    app = Application.builder().token(token).build()
+    app = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(_PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .build()
+    )
 
     conv = ConversationHandler(
         entry_points=[
@@ -521,11 +710,15 @@ def main() -> None:
                 MessageHandler(filters.Document.ALL, report_file_received),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, report_text_received),
             ],
+            ConversationHandler.TIMEOUT: [
+                TypeHandler(Update, timeout_handler),
+            ],
         },
         fallbacks=[
             CommandHandler("cancel", cancel_handler),
             CommandHandler("start", start_handler),
         ],
+        conversation_timeout=CONVERSATION_TIMEOUT_S,
     )
 
     app.add_handler(CommandHandler("start", start_handler))
@@ -542,5 +735,5 @@ if __name__ == "__main__":
     try:
         asyncio.get_running_loop()
     except RuntimeError:
-        asyncio.set_event_loop(asyncio.new_event_loop())
+        asyncio.set_event_loop(uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop())
     main()
@@ -46,6 +46,13 @@ DEFAULT_DEPARTMENT = "КАФЕДРА «КОМПЛЕКСНОЕ ОБЕСПЕЧЕН
 DEFAULT_CITY = "Санкт – Петербург"
 DEFAULT_GROUP = "ИЗ–41"
 
+_BLACK = RGBColor(0, 0, 0)
+
+# Clark-notation names for the Cyrillic font fallback, resolved once
+_QN_RFONTS = qn("w:rFonts")
+_QN_EASTASIA = qn("w:eastAsia")
+_QN_CS = qn("w:cs")
+
 
 def setup_page(doc: Document) -> None:
     """Configure page size and margins for GOST 7.32-2017."""
@@ -59,43 +66,12 @@ def setup_page(doc: Document) -> None:
     section.orientation = WD_ORIENT.PORTRAIT
 
 
-def set_run_font(run, font_name=FONT_NAME, font_size=FONT_SIZE, bold=False, italic=False):
-    """Apply font settings to a run."""
-    run.font.name = font_name
-    run.font.size = font_size
-    run.font.bold = bold
-    run.font.italic = italic
-    run.font.color.rgb = RGBColor(0, 0, 0)
-    # Force font for Cyrillic characters
-    r = run._element
-    rPr = r.get_or_add_rPr()
-    rFonts = rPr.find(qn("w:rFonts"))
-    if rFonts is None:
-        rFonts = r.makeelement(qn("w:rFonts"), {})
-        rPr.insert(0, rFonts)
-    rFonts.set(qn("w:eastAsia"), font_name)
-    rFonts.set(qn("w:cs"), font_name)
-
-
-def set_paragraph_format(paragraph, alignment=WD_ALIGN_PARAGRAPH.JUSTIFY,
-                         first_line_indent=PARAGRAPH_INDENT,
-                         space_before=Pt(0), space_after=Pt(0),
-                         line_spacing=LINE_SPACING):
-    """Apply GOST paragraph formatting."""
-    fmt = paragraph.paragraph_format
-    fmt.alignment = alignment
-    fmt.first_line_indent = first_line_indent
-    fmt.space_before = space_before
-    fmt.space_after = space_after
-    fmt.line_spacing = line_spacing
-
-
 def setup_default_style(doc: Document) -> None:
     """Set the Normal style to GOST defaults."""
     style = doc.styles["Normal"]
     style.font.name = FONT_NAME
     style.font.size = FONT_SIZE
-    style.font.color.rgb = RGBColor(0, 0, 0)
+    style.font.color.rgb = _BLACK
     fmt = style.paragraph_format
     fmt.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
     fmt.first_line_indent = PARAGRAPH_INDENT
@@ -104,9 +80,8 @@ def setup_default_style(doc: Document) -> None:
     fmt.space_after = Pt(0)
     # Cyrillic font fallback
     rPr = style.element.get_or_add_rPr()
-    rFonts = rPr.find(qn("w:rFonts"))
+    rFonts = rPr.find(_QN_RFONTS)
     if rFonts is None:
-        rFonts = style.element.makeelement(qn("w:rFonts"), {})
+        rFonts = style.element.makeelement(_QN_RFONTS, {})
         rPr.insert(0, rFonts)
-    rFonts.set(qn("w:eastAsia"), FONT_NAME)
-    rFonts.set(qn("w:cs"), FONT_NAME)
+    rFonts.attrib.update({_QN_EASTASIA: FONT_NAME, _QN_CS: FONT_NAME})
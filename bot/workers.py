@@ -0,0 +1,61 @@
+"""Process pools for CPU-bound work (DOCX building, PDF text extraction)."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Workers are not forked from this process directly: by the time a pool is created it
+# already runs threads (to_thread, uvloop's resolver), and forking those can deadlock
+POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# Imported once by the fork server, so workers forked from it start with python-docx, lxml
+# and pypdfium2 already loaded instead of importing them on their first task. bot.main is
+# listed because multiprocessing re-runs the entry module in every worker, imports and all.
+# (Under spawn, e.g. on Windows, every worker still imports them itself.)
+PRELOAD_MODULES = ["__main__", "bot.main", "bot.docx_builder", "bot.ai_processor"]
+if POOL_CONTEXT.get_start_method() == "forkserver":
+    POOL_CONTEXT.set_forkserver_preload(PRELOAD_MODULES)
+
+
+class WorkerPool:
+    """A lazily created process pool, replaced with a fresh one when a worker dies.
+
+    A crashed worker (OOM, a segfault in a C extension) breaks a ProcessPoolExecutor
+    for good; here the broken pool is discarded and the call is retried once.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _get(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=POOL_CONTEXT)
+        return self._pool
+
+    def _discard(self, pool: ProcessPoolExecutor) -> None:
+        # Concurrent calls on the same broken pool each end up here; replace it only once
+        if self._pool is pool:
+            self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in a worker process; raises BrokenProcessPool if it dies twice."""
+        loop = asyncio.get_running_loop()
+        for retry in (True, False):
+            pool = self._get()
+            try:
+                return await loop.run_in_executor(pool, fn, *args)
+            except BrokenProcessPool:
+                self._discard(pool)
+                if not retry:
+                    raise
+                logger.warning("Worker process died; retrying %s on a fresh pool", fn.__name__)